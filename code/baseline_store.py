@@ -0,0 +1,260 @@
+###
+#
+# Filename: baseline_store.py
+# Author: Derek Steffan
+#
+# This file contains a store of what "normal" chat activity looks like
+# for every channel, built up over many past broadcasts, for scoring
+# new broadcasts against.
+#
+# highlight_by_stdev and highlight_by_probability scale the rolling
+# standard deviation of every broadcast by its own mean and stdev, so
+# the whole broadcast has to be known before anything can be scored,
+# and a threshold of 4 is relative to how that one broadcast went.
+# Given a baseline from this store instead, every second is scored
+# against the channel's past broadcasts, the same way for every stream,
+# and without looking at the rest of the broadcast.
+#
+# For every channel (and rolling window size) the store keeps the count,
+# mean and sum of squared differences of the rolling standard deviation.
+# These can be added together, so baselines built in different processes
+# (e.g. one per broadcast) are simply merged; see build_baseline_store.
+#
+# Run it from the code directory with e.g.:
+# python baseline_store.py "../data/logs/*.log" --bot-name admiralbullbot
+#
+###
+
+import argparse
+import glob
+import json
+import math
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import chat_cache
+import twitch_chat_format as tcf
+
+
+
+# Where the store is saved by default, relative to the code directory.
+BASELINE_PATH = "../data/baselines.json"
+
+
+
+class RollingStdBaseline:
+
+    # roll
+    # Size of the rolling window the standard deviations were taken
+    # over; the highlighters refuse a baseline made with another one.
+    def __init__(self, roll = None, n = 0, mean = 0.0, m2 = 0.0):
+
+        self.roll = roll
+        self.n = int(n)
+        self._mean = float(mean)
+        self.m2 = float(m2)
+
+
+
+    # Adds every value of a rolling standard deviation (NaNs are skipped).
+    def add(self, stdev):
+
+        values = np.asarray(stdev, dtype = float)
+        values = values[~np.isnan(values)]
+
+        if len(values) == 0:
+            return self
+
+        other = RollingStdBaseline(self.roll, len(values), values.mean(),
+                                   ((values - values.mean()) ** 2).sum())
+
+        return self.merge(other)
+
+
+
+    # Adds another baseline into this one, using the parallel form of
+    # Welford's algorithm for the mean and variance.
+    def merge(self, other):
+
+        if self.roll is not None and other.roll is not None and self.roll != other.roll:
+            raise ValueError(f"cannot merge baselines with roll = {self.roll} and roll = {other.roll}")
+
+        self.roll = self.roll if self.roll is not None else other.roll
+        n = self.n + other.n
+
+        if n == 0:
+            return self
+
+        delta = other._mean - self._mean
+
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self._mean += delta * other.n / n
+        self.n = n
+
+        return self
+
+
+
+    @property
+    def mean(self):
+        return self._mean if self.n > 0 else math.nan
+
+
+
+    # Sample stdev, like pd.Series.std.
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else math.nan
+
+
+
+    def to_dict(self):
+        return {"roll": self.roll, "n": self.n, "mean": self._mean, "m2": self.m2}
+
+
+
+    # Anything else in 'data' is ignored, e.g. the histograms
+    # kept in the stores saved by earlier versions.
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("roll"), data["n"], data["mean"], data["m2"])
+
+
+
+class BaselineStore:
+
+    def __init__(self, baselines = None):
+
+        # (channel, roll) to RollingStdBaseline.
+        self.baselines = dict(baselines or {})
+
+
+
+    # The baseline of a channel, which can be passed to highlight_by_stdev,
+    # highlight_by_probability or LiveHighlighter as the 'baseline'.
+    def get(self, channel, roll = 5):
+
+        key = (channel.lower(), roll)
+
+        if key not in self.baselines:
+            raise KeyError(f"no baseline for channel '{channel}' with roll = {roll}")
+
+        return self.baselines[key]
+
+
+
+    @property
+    def channels(self):
+        return sorted({channel for channel, _ in self.baselines})
+
+
+
+    # Adds one broadcast's messages per second series to the baseline of
+    # its channel, for every rolling window size in 'rolls'.
+    def add_series(self, channel, mps, rolls = (5,)):
+
+        for roll in rolls:
+            stdev = mps.rolling(roll).std().to_numpy()
+            self.baselines.setdefault((channel.lower(), roll), RollingStdBaseline(roll)).add(stdev)
+
+        return self
+
+
+
+    # Adds every baseline of another store into this one.
+    def merge(self, other):
+
+        for key, baseline in other.baselines.items():
+            self.baselines.setdefault(key, RollingStdBaseline(key[1])).merge(baseline)
+
+        return self
+
+
+
+    def save(self, path = BASELINE_PATH):
+
+        data = [{"channel": channel, **baseline.to_dict()}
+                for (channel, _), baseline in sorted(self.baselines.items())]
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+
+        with open(temp_path, "w", encoding = "utf-8") as output:
+            json.dump(data, output)
+
+        os.replace(temp_path, path)
+
+
+
+    @classmethod
+    def load(cls, path = BASELINE_PATH):
+
+        with open(path, encoding = "utf-8") as saved:
+            data = json.load(saved)
+
+        return cls({(entry["channel"], entry["roll"]): RollingStdBaseline.from_dict(entry)
+                    for entry in data})
+
+
+
+# Builds a store from many .log files in a pool of processes. Every log
+# gets a store of its own, and the stores are merged as they come back.
+# The messages of 'bot_names' are removed first, like highlight_pipeline.py.
+def build_baseline_store(log_paths, rolls = (5,), bot_names = (), n_jobs = None,
+                         cache_dir = chat_cache.CACHE_DIR):
+
+    store = BaselineStore()
+
+    with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+
+        futures = [pool.submit(_log_baseline, path, tuple(rolls), list(bot_names), cache_dir)
+                   for path in log_paths]
+
+        for future in as_completed(futures):
+            store.merge(future.result())
+
+    return store
+
+
+
+# Baseline store of a single .log file, for build_baseline_store.
+def _log_baseline(path, rolls, bot_names, cache_dir):
+
+    df = chat_cache.cached_twitch_chat_format(path, cache_dir = cache_dir)
+
+    if bot_names:
+        df = tcf.filter_bot_messages(df, bot_names)
+
+    store = BaselineStore()
+
+    # A log holds the chat of one channel, see twitch_chat_scrape.py.
+    for channel, messages in df.groupby("channel", observed = True):
+        store.add_series(str(channel), tcf.messages_per_second(messages), rolls)
+
+    return store
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Build the baselines of many Twitch chat logs.")
+    parser.add_argument("logs", nargs = "+", help = ".log files or glob patterns")
+    parser.add_argument("--output", default = BASELINE_PATH)
+    parser.add_argument("--bot-name", action = "append", default = [], dest = "bot_names")
+    parser.add_argument("--roll", type = int, action = "append", dest = "rolls",
+                        help = "rolling window size; can be given more than once (default 5)")
+    parser.add_argument("--jobs", type = int, default = None, help = "number of processes")
+    parser.add_argument("--merge", action = "store_true", help = "add to the store at --output")
+    args = parser.parse_args()
+
+    log_paths = [path for pattern in args.logs for path in sorted(glob.glob(pattern))]
+
+    store = build_baseline_store(log_paths, args.rolls or (5,), args.bot_names, args.jobs)
+
+    if args.merge and os.path.exists(args.output):
+        store = BaselineStore.load(args.output).merge(store)
+
+    store.save(args.output)
+
+    print(f"Baselines of {len(store.channels)} channels from {len(log_paths)} logs saved to {args.output}")
@@ -0,0 +1,439 @@
+###
+#
+# Filename: benchmark.py
+# Author: Derek Steffan
+#
+# This script contains a few quick benchmarks for the slower parts
+# of formatting and highlighting, so that changes to them can be
+# checked for speed as well as correctness.
+#
+# The main benchmark runs the whole pipeline, from parsing a .log file
+# to finding the start and end times of the clips, on logs generated by
+# synthetic_chat.py at a few different sizes. The timings can be saved
+# as JSON and compared against the timings from an earlier commit.
+#
+# Run it from the code directory with:
+# python benchmark.py --output timings.json
+# python benchmark.py --output new.json --compare timings.json
+#
+###
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import scipy.stats
+import chat_cache
+import highlighter as hl
+from live_highlighter import LiveHighlighter
+import synthetic_chat
+import twitch_chat_format as tcf
+
+
+
+# Times a function call, returning the best of 'repeat' runs in
+# seconds along with the result of the last run.
+def _time_call(func, *args, repeat = 3, **kwargs):
+
+    best = float("inf")
+
+    for _ in range(repeat):
+        then = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - then)
+
+    return best, result
+
+
+
+# Parses the same .log file serially and with an increasing number of
+# processes, checking that every parallel result is identical to the
+# serial one and printing out the speedup for each number of processes.
+# Speedup can only be near-linear up to the number of cores on the
+# machine, so counts higher than os.cpu_count() are skipped.
+def benchmark_parallel_format(path, n_jobs = (1, 2, 4, 8), repeat = 3):
+
+    serial_time, serial = _time_call(tcf.twitch_chat_format, path, repeat = repeat)
+
+    print(f"{len(serial)} messages in {os.path.getsize(path) / 1e6:.1f} MB")
+    print(f"serial: {serial_time:.3f} seconds")
+
+    timings = {1: serial_time}
+
+    for n in n_jobs:
+
+        if n == 1:
+            continue
+
+        if n > (os.cpu_count() or 1):
+            print(f"{n} processes: skipped, only {os.cpu_count()} cores available")
+            continue
+
+        parallel_time, parallel = _time_call(tcf.twitch_chat_format, path,
+                                             n_jobs = n, repeat = repeat)
+
+        pd.testing.assert_frame_equal(parallel, serial)
+
+        timings[n] = parallel_time
+        print(f"{n} processes: {parallel_time:.3f} seconds,",
+              f"{serial_time / parallel_time:.2f}x speedup")
+
+    return timings
+
+
+
+# The original version of highlighter.highlight_by_probability, which
+# builds a frozen scipy distribution for every second. Only kept here
+# to check the vectorized version against.
+def _highlight_by_probability_loop(df, sensitivity = 0.05, roll = 5):
+
+    z_score = hl._scale_data(df, roll)
+
+    mu = z_score.mean()
+    sig = z_score.std()
+
+    mc_prob = []
+
+    for score in z_score:
+        mc_prob.append(scipy.stats.norm(mu, sig).pdf(score))
+        mu = score
+
+    mc_prob = pd.Series(mc_prob, index = df.index)
+
+    return (mc_prob <= sensitivity).astype(int)
+
+
+
+# Compares highlight_by_probability against the original loop on a
+# messages per second .csv, checking that both flag the same seconds.
+def benchmark_highlight_by_probability(path, sensitivity = 0.05, roll = 5, repeat = 3):
+
+    time_series = pd.read_csv(path, index_col = 0, parse_dates = True)
+    time_series = time_series.rename(columns = {"0": "mps"})
+
+    loop_time, loop = _time_call(_highlight_by_probability_loop, time_series,
+                                 sensitivity, roll, repeat = 1)
+    vector_time, vector = _time_call(hl.highlight_by_probability, time_series,
+                                     sensitivity, roll, repeat = repeat)
+
+    pd.testing.assert_series_equal(vector, loop)
+
+    print(f"{len(time_series)} seconds, {vector.sum()} flagged")
+    print(f"loop: {loop_time:.3f} seconds")
+    print(f"vectorized: {vector_time:.5f} seconds, {loop_time / vector_time:.0f}x speedup")
+
+    return loop_time, vector_time
+
+
+
+# Reads a .log file through chat_cache twice, once into an empty cache
+# and once from it, checking that the cached frames are the same as the
+# ones that were just parsed and printing out the time of both reads.
+def benchmark_chat_cache(path):
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+
+        for name, func, kwargs in (("format", chat_cache.cached_twitch_chat_format, {}),
+                                   ("mps", chat_cache.cached_messages_per_second, {}),
+                                   ("mps by username", chat_cache.cached_messages_per_second,
+                                    {"by": "username"})):
+
+            cold_time, cold = _time_call(func, path, cache_dir = cache_dir, repeat = 1, **kwargs)
+            warm_time, warm = _time_call(func, path, cache_dir = cache_dir, repeat = 3, **kwargs)
+
+            if isinstance(cold, pd.Series):
+                pd.testing.assert_series_equal(warm, cold)
+            else:
+                pd.testing.assert_frame_equal(warm, cold)
+
+            print(f"{name}: cold {cold_time:.3f} seconds, warm {warm_time:.4f} seconds")
+
+
+
+# Replays a messages per second .csv through LiveHighlighter one second
+# at a time and checks it against the batch functions, for every roll in
+# 'rolls'. A stretch of 'silent' seconds with no messages is put in
+# front of the series, so that the live version also has to get through
+# a start where the stdev of the rolling stdev is 0.
+
+# With a baseline, the flags of both methods have to be the same as the
+# batch functions given that baseline. Without one, the live version
+# scales every second with the running mean and stdev of the rolling
+# stdevs up to it, so its z-scores are checked against the batch scaling
+# done with expanding statistics instead, and its final running mean
+# and stdev against the batch ones.
+def benchmark_live_highlighter(path, rolls = (5, 15), silent = 30):
+
+    time_series = pd.read_csv(path, index_col = 0, parse_dates = True)
+    time_series = time_series.rename(columns = {"0": "mps"})
+
+    start = time_series.index[0] - pd.Timedelta(seconds = silent)
+    silence = pd.DataFrame({"mps": 0}, index = pd.date_range(start, periods = silent, freq = "s"))
+    time_series = pd.concat([silence, time_series])
+
+    for roll in rolls:
+
+        stdev = time_series["mps"].rolling(roll).std()
+        baseline = (stdev.mean(), stdev.std())
+
+        for method, batch in (("stdev", hl.highlight_by_stdev), ("probability", hl.highlight_by_probability)):
+
+            live_time, live = _time_call(_replay_live, time_series["mps"], method, roll, baseline, repeat = 1)
+            flags = batch(time_series, roll = roll, baseline = baseline)
+
+            np.testing.assert_array_equal(live["flag"], flags.to_numpy())
+
+            print(f"roll = {roll}, {method} with a baseline: {flags.sum()} flagged,",
+                  f"{len(time_series) / live_time:.0f} updates per second")
+
+            _, live = _time_call(_replay_live, time_series["mps"], method, roll, None, repeat = 1)
+
+            expected = (stdev - stdev.expanding().mean()) / stdev.expanding().std()
+            expected = expected.where(stdev.expanding().std() > 0)
+
+            np.testing.assert_allclose(live["z_score"], expected.to_numpy(), rtol = 1e-9, atol = 1e-9)
+            np.testing.assert_allclose(live["final"], baseline, rtol = 1e-9)
+
+            print(f"roll = {roll}, {method} without a baseline: {int(live['flag'].sum())} flagged")
+
+
+
+# Feeds a series through a LiveHighlighter, returning its flag and
+# z-score after every update and its final running mean and stdev.
+def _replay_live(mps, method, roll, baseline):
+
+    live = LiveHighlighter(method, roll = roll, baseline = baseline)
+    flags, z_scores = [], []
+
+    for value in mps:
+        live.update(value)
+        flags.append(int(live.in_highlight))
+        z_scores.append(live.z_score)
+
+    return {"flag": np.array(flags), "z_score": np.array(z_scores),
+            "final": (live.mean, live.std)}
+
+
+
+# The notebook's way of building the documents for the topic model,
+# from 03_topic_modeling.ipynb, returning the bag-of-words for every
+# rolling window of 'roll' seconds.
+def _topic_bows_notebook(data, roll = 5):
+
+    # Imported here so that the rest of the benchmarks
+    # do not need gensim and nltk installed.
+    import gensim
+    from nltk.stem import WordNetLemmatizer, SnowballStemmer
+
+    def preprocess(text):
+        result = []
+        for token in gensim.utils.simple_preprocess(text):
+            if token not in gensim.parsing.preprocessing.STOPWORDS and len(token) > 2:
+                token = WordNetLemmatizer().lemmatize(token, pos = 'v')
+                result.append(SnowballStemmer("english").stem(token))
+        return result
+
+    docs = [" ".join(data[data.index == sec]["message"].to_list()) for sec in data.index.unique()]
+    documents = pd.DataFrame({"doc": docs}, index = data.index.unique())
+
+    documents_5 = [" ".join(documents[i:i + roll]["doc"]) for i in range(0, documents.shape[0], roll)]
+    documents_rolling = [" ".join(documents[i:i + roll]["doc"]) for i in range(0, documents.shape[0])]
+
+    processed_docs = pd.Series(documents_5).map(preprocess)
+
+    dictionary = gensim.corpora.Dictionary(processed_docs)
+    dictionary.filter_extremes(no_below = 5, no_above = 0.5, keep_n = 1000)
+
+    return [dictionary.doc2bow(preprocess(doc)) for doc in documents_rolling]
+
+
+
+# Same as above, using topic_highlighter.py.
+def _topic_bows_module(data, roll = 5):
+
+    import gensim
+    import topic_highlighter as th
+
+    seconds = th.second_tokens(data)
+    blocks = [[token for tokens in seconds.iloc[i:i + roll] for token in tokens]
+              for i in range(0, len(seconds), roll)]
+
+    dictionary = gensim.corpora.Dictionary(blocks)
+    dictionary.filter_extremes(no_below = 5, no_above = 0.5, keep_n = 1000)
+
+    return list(th.rolling_bows(seconds, dictionary, roll))
+
+
+
+# Compares building the topic model's documents the notebook's way
+# against topic_highlighter.py on a formatted chat .csv, checking that
+# both give the same bag-of-words for every second. Fitting the LDA
+# model itself is the same either way and is not timed.
+def benchmark_topic_documents(path, roll = 5):
+
+    data = pd.read_csv(path, index_col = "time", parse_dates = True)
+
+    notebook_time, notebook = _time_call(_topic_bows_notebook, data, roll, repeat = 1)
+    module_time, module = _time_call(_topic_bows_module, data, roll, repeat = 1)
+
+    assert notebook == module
+
+    print(f"{len(module)} seconds of messages")
+    print(f"notebook: {notebook_time:.3f} seconds")
+    print(f"topic_highlighter: {module_time:.3f} seconds, {notebook_time / module_time:.1f}x speedup")
+
+    return notebook_time, module_time
+
+
+
+# Generates a synthetic log for every scale (a multiple of 'minutes'
+# of chat) and times every stage of the pipeline on it. Returns a
+# dictionary that can be saved as JSON with save_benchmark.
+def benchmark_pipeline(scales = (1, 10, 100), minutes = 60, repeat = 3, **log_kwargs):
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        for scale in scales:
+
+            path = os.path.join(temp_dir, f"chat_synthetic_{scale}x.log")
+            generated = synthetic_chat.generate_chat_log(path, minutes = minutes * scale, **log_kwargs)
+
+            print("-" * 40)
+            print(f"{scale}x: {generated['n_messages']} messages over {minutes * scale} minutes")
+
+            bot_name = log_kwargs.get("bot_name", "syntheticbot")
+
+            for stage, seconds in _time_stages(path, bot_name, repeat).items():
+                print(f"{stage}: {seconds:.4f} seconds")
+                results.append({"scale": scale,
+                                "n_messages": generated["n_messages"],
+                                "stage": stage,
+                                "seconds": seconds})
+
+    return {"commit": _git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "minutes": minutes,
+            "results": results}
+
+
+
+# Times every stage of the pipeline, feeding the output of
+# each stage into the next like the notebooks do.
+def _time_stages(path, bot_name, repeat):
+
+    timings = {}
+
+    timings["twitch_chat_format"], df = _time_call(tcf.twitch_chat_format, path, repeat = repeat)
+
+    timings["filter_bot_messages"], df = _time_call(tcf.filter_bot_messages, df, 
+                                                    bot_name, repeat = repeat)
+
+    timings["messages_per_second"], mps = _time_call(tcf.messages_per_second, df, repeat = repeat)
+    time_series = mps.to_frame("mps")
+
+    timings["highlight_by_stdev"], _ = _time_call(hl.highlight_by_stdev, time_series, repeat = repeat)
+
+    timings["highlight_by_probability"], flags = _time_call(hl.highlight_by_probability, 
+                                                            time_series, repeat = repeat)
+    time_series["highlight"] = flags
+
+    timings["get_highlights_index"], _ = _time_call(hl.get_highlights_index,
+                                                    time_series.reset_index(drop = True),
+                                                    repeat = repeat)
+
+    timings["get_highlights_timestamp"], _ = _time_call(hl.get_highlights_timestamp, 
+                                                        time_series, repeat = repeat)
+
+    return timings
+
+
+
+def save_benchmark(results, path):
+
+    with open(path, "w", encoding = "utf-8") as output:
+        json.dump(results, output, indent = 2)
+
+
+
+# Prints out how much faster or slower every stage got between two
+# files saved by save_benchmark, e.g. from two different commits.
+def compare_benchmarks(old_path, new_path):
+
+    with open(old_path, encoding = "utf-8") as old, open(new_path, encoding = "utf-8") as new:
+        old, new = json.load(old), json.load(new)
+
+    old_times = {(r["scale"], r["stage"]): r["seconds"] for r in old["results"]}
+
+    print("-" * 40)
+    print(f"{old['commit']} -> {new['commit']}")
+
+    for r in new["results"]:
+        key = (r["scale"], r["stage"])
+
+        if key in old_times:
+            ratio = r["seconds"] / old_times[key]
+            print(f"{r['scale']}x {r['stage']}: {old_times[key]:.4f} -> {r['seconds']:.4f} seconds ({ratio:.2f}x)")
+
+
+
+# Commit the benchmark was run on, if the code is in a git repository.
+def _git_commit():
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Benchmark the chat highlighting pipeline.")
+    parser.add_argument("--scales", type = int, nargs = "+", default = [1, 10, 100],
+                        help = "sizes of the synthetic logs, in multiples of --minutes")
+    parser.add_argument("--minutes", type = float, default = 60,
+                        help = "minutes of chat in the 1x log")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--output", help = "save the timings to this JSON file")
+    parser.add_argument("--compare", help = "JSON file of earlier timings to compare against")
+    parser.add_argument("--checks", action = "store_true",
+                        help = "also check the vectorized and parallel code against the originals")
+    args = parser.parse_args()
+
+    results = benchmark_pipeline(args.scales, args.minutes, args.repeat)
+
+    if args.output:
+        save_benchmark(results, args.output)
+
+    if args.compare:
+
+        # Without --output, the timings are only saved for comparing them.
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            new_path = args.output or os.path.join(temp_dir, "timings.json")
+
+            if not args.output:
+                save_benchmark(results, new_path)
+
+            compare_benchmarks(args.compare, new_path)
+
+    if args.checks:
+        print("-" * 40)
+        benchmark_highlight_by_probability("../data/formatted/admiralbulldog_4_30_mps.csv")
+        print("-" * 40)
+        benchmark_live_highlighter("../data/formatted/admiralbulldog_4_30_mps.csv")
+        print("-" * 40)
+        benchmark_parallel_format("../data/logs/chat_admiralbulldog_4_30.log")
+        print("-" * 40)
+        benchmark_chat_cache("../data/logs/chat_admiralbulldog_4_30.log")
+        print("-" * 40)
+        benchmark_topic_documents("../data/formatted/admiralbulldog_4_30.csv")
@@ -0,0 +1,190 @@
+###
+#
+# Filename: chat_cache.py
+# Author: Derek Steffan
+#
+# This script contains a small cache for the output of twitch_chat_format
+# and messages_per_second, so that the notebooks do not have to re-parse
+# the same .log file (or re-read a large .csv) every time they are run.
+#
+# Cached results are written as uncompressed Arrow IPC files, with
+# the timestamps stored as int64, usernames and channels stored as
+# categoricals, and are read back with memory mapping. Every entry is
+# keyed on the path, modification time and size of the source .log
+# file along with PARSER_VERSION from twitch_chat_format.py, so editing
+# either the log or the parser makes the old entry go stale. A warm read
+# gives back exactly the frame that was cached, down to the frequency of
+# the index and the type of the column labels.
+#
+###
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import twitch_chat_format as tcf
+
+
+
+# Default location of the cache, relative to the code directory
+# in the same way as the paths used throughout the notebooks.
+CACHE_DIR = "../data/cache"
+
+# Version of the layout of the cache files, part of every key like
+# PARSER_VERSION, so that entries written before a change are not read.
+_FORMAT_VERSION = 2
+
+# Columns stored as categoricals when present.
+_CATEGORICAL_COLUMNS = ("username", "channel")
+
+# Column the index is stored in, which cannot be the name of a column of
+# the frame (or a Twitch username in messages_per_second(by = "username")).
+_INDEX_COLUMN = "\x00index"
+
+
+
+# Returns the same dataframe as twitch_chat_format(path, categorical = True),
+# parsing the .log file only if there is no up to date copy in the cache.
+def cached_twitch_chat_format(path, cache_dir = CACHE_DIR, n_jobs = 1):
+
+    cache_path = _cache_path(path, "format", {}, cache_dir)
+
+    if os.path.exists(cache_path):
+        return _read_frame(cache_path)
+
+    df = tcf.twitch_chat_format(path, n_jobs = n_jobs, categorical = True)
+    _write_frame(df, cache_path)
+
+    return df
+
+
+
+# Returns the same series as messages_per_second for the messages in
+# the .log file at 'path', optionally after removing the messages of
+# 'bot_name' with filter_bot_messages. Any other keyword arguments are
+# passed along to messages_per_second and become part of the cache key.
+def cached_messages_per_second(path, bot_name = None, cache_dir = CACHE_DIR, **kwargs):
+
+    # The progress callback has no effect on the result.
+    kwargs.pop("progress", None)
+
+    cache_path = _cache_path(path, "mps", dict(kwargs, bot_name = bot_name), cache_dir)
+
+    if os.path.exists(cache_path):
+        return _read_frame(cache_path)
+
+    df = cached_twitch_chat_format(path, cache_dir = cache_dir)
+
+    if bot_name is not None:
+        df = tcf.filter_bot_messages(df, bot_name)
+
+    mps = tcf.messages_per_second(df, **kwargs)
+    _write_frame(mps, cache_path)
+
+    return mps
+
+
+
+# Builds the file name of a cache entry from everything that could
+# change the result: the source file, the parser version, the stage
+# and the arguments of that stage.
+def _cache_path(path, stage, params, cache_dir):
+
+    stat = os.stat(path)
+
+    key = json.dumps({"path": os.path.abspath(path),
+                      "mtime": stat.st_mtime_ns,
+                      "size": stat.st_size,
+                      "version": tcf.PARSER_VERSION,
+                      "format": _FORMAT_VERSION,
+                      "stage": stage,
+                      "params": params}, sort_keys = True, default = str)
+
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    return os.path.join(cache_dir, f"{name}_{stage}_{digest}.arrow")
+
+
+
+# Writes a dataframe or series with a datetime index to an Arrow file.
+def _write_frame(data, cache_path):
+
+    is_series = isinstance(data, pd.Series)
+    df = data.to_frame("0") if is_series else data
+
+    if _INDEX_COLUMN in map(str, df.columns):
+        raise ValueError(f"a column cannot be named {_INDEX_COLUMN!r}")
+
+    # Timestamps are stored as plain int64 in the unit of the index,
+    # which is kept in the metadata so it can be restored exactly.
+    columns = {_INDEX_COLUMN: df.index.values.view("int64")}
+
+    for col in df.columns:
+        values = df[col]
+
+        if col in _CATEGORICAL_COLUMNS:
+            values = values.astype("category")
+
+        columns[str(col)] = values
+
+    # Along with the frequency of the index and the type of the column
+    # labels, e.g. the usernames of messages_per_second(by = "username").
+    metadata = {"series": is_series,
+                "unit": np.datetime_data(df.index.dtype)[0],
+                "freq": df.index.freqstr,
+                "index_name": df.index.name,
+                "columns_name": df.columns.name,
+                "columns_dtype": str(df.columns.dtype)}
+
+    if isinstance(df.columns, pd.CategoricalIndex):
+        metadata["columns_categories"] = df.columns.categories.tolist()
+        metadata["columns_ordered"] = bool(df.columns.ordered)
+
+    table = pa.Table.from_pandas(pd.DataFrame(columns), preserve_index = False)
+    table = table.replace_schema_metadata({"chat_cache": json.dumps(metadata)})
+
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok = True)
+
+    # Write to a temporary file first so that an interrupted write (or
+    # another process reading at the same time) never sees half a file.
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+
+    with pa.OSFile(temp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    os.replace(temp_path, cache_path)
+
+
+
+# Reads back a file written by _write_frame, memory mapping it so that
+# the numeric and categorical columns do not have to be copied.
+def _read_frame(cache_path):
+
+    with pa.memory_map(cache_path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+
+    metadata = json.loads(table.schema.metadata[b"chat_cache"])
+
+    time = table.column(_INDEX_COLUMN).to_numpy().view(f"datetime64[{metadata['unit']}]")
+    index = pd.DatetimeIndex(time, name = metadata["index_name"], freq = metadata.get("freq"))
+
+    df = table.drop_columns([_INDEX_COLUMN]).to_pandas()
+    df.index = index
+
+    if "columns_categories" in metadata:
+        df.columns = pd.CategoricalIndex(df.columns, categories = metadata["columns_categories"],
+                                         ordered = metadata["columns_ordered"])
+
+    elif len(df.columns):
+        df.columns = df.columns.astype(metadata["columns_dtype"])
+
+    df.columns.name = metadata["columns_name"]
+
+    if metadata["series"]:
+        return df["0"].rename(None)
+
+    return df
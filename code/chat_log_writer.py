@@ -0,0 +1,334 @@
+###
+#
+# Filename: chat_log_writer.py
+# Author: Derek Steffan
+#
+# This file contains the writer used by twitch_chat_scrape.py and
+# twitch_chat_ingest.py to save raw chat messages to a .log file.
+#
+# Messages are put on a queue and written by a separate thread, so that
+# reading from the socket never waits on formatting or the disk. The
+# thread demojizes the messages in batches, stamps them with a timestamp
+# that is only formatted once per second, and writes them in large
+# blocks. The log can optionally be rotated after a certain size or
+# amount of time, and compressed with gzip or zstd (the latter needs
+# the 'zstandard' package). Every file written is in the same format
+# as the original logging setup, i.e.
+#
+# 2019-04-30_08:56:59 ;;; <raw message>
+#
+# or, with milliseconds = True,
+#
+# 2019-04-30_08:56:59.123 ;;; <raw message>
+#
+# so it can be read by twitch_chat_format.py, compressed or not.
+#
+# If writing fails in the thread (e.g. the disk is full), the writer
+# stops, and the error is raised by the next call to write or close.
+#
+###
+
+import gzip
+import io
+import os
+import queue
+import threading
+import time
+from emoji import demojize
+import metrics
+
+
+
+# Extension added to the log files for every kind of compression.
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# Marks the end of the queue.
+_CLOSE = object()
+
+# Separates the messages of a batch after demojizing them all at once.
+# IRC lines cannot contain NUL characters, so no message holds one.
+_SEPARATOR = "\0"
+
+
+
+class ChatLogWriter:
+
+    # path
+    # Where the log is written. If rotating, every file gets a number
+    # added before the extension, e.g. chat_000.log, chat_001.log, ...
+
+    # buffer_size
+    # Number of characters to collect before writing them to disk.
+
+    # flush_interval
+    # Maximum number of seconds a message waits before being written.
+
+    # max_bytes, rotate_minutes
+    # Start a new file after this many characters or minutes; None for never.
+    # A file only ever holds whole messages, and is not allowed to go over
+    # 'max_bytes' unless a single message is longer than that. The size is
+    # counted before compression, so compressed files end up smaller.
+    # Files are rotated by time only between writes to disk, i.e. up to
+    # 'flush_interval' seconds late.
+
+    # compression
+    # None, "gzip" or "zstd".
+
+    # milliseconds
+    # Add milliseconds to every timestamp, e.g. 2019-04-30_08:56:59.123,
+    # so that the messages within a second can be told apart.
+    def __init__(self, path, buffer_size = 1 << 20, flush_interval = 1.0,
+                 max_bytes = None, rotate_minutes = None, compression = None,
+                 milliseconds = False):
+
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"compression must be one of {list(COMPRESSION_SUFFIXES)}")
+
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_minutes = rotate_minutes
+        self.compression = compression
+        self.milliseconds = milliseconds
+
+        # Every file written so far, in order.
+        self.paths = []
+        self.n_messages = 0
+
+        self._queue = queue.Queue()
+        self._file = None
+        self._file_size = 0
+        self._file_opened = None
+        self._second = None
+        self._stamp = None
+
+        # What stopped the thread, if anything, and whether it has been
+        # raised yet (it is only raised once).
+        self._error = None
+        self._error_raised = False
+
+        self._open_next_file()
+
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+
+
+    # Number of messages waiting to be written.
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+
+
+    # Queues up a message to be written along with the time it was received.
+    def write(self, message):
+
+        if self._error is not None:
+            self._raise_error()
+
+        self._queue.put((time.time(), message))
+
+
+
+    # Writes out everything still in the queue and closes the file.
+    def close(self):
+
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+        if self._error is not None and not self._error_raised:
+            self._raise_error()
+
+
+
+    def _raise_error(self):
+
+        self._error_raised = True
+
+        raise RuntimeError(f"writing the log to {self.paths[-1]} failed, "
+                           f"{type(self._error).__name__}: {self._error}") from self._error
+
+
+
+    def _run(self):
+
+        try:
+            self._write_queue()
+
+        except Exception as error:
+            self._error = error
+
+            # Whatever made it to the file so far is kept.
+            try:
+                self._file.close()
+            except Exception:
+                pass
+
+
+
+    def _write_queue(self):
+
+        buffer = []
+        buffered = 0
+        last_flush = time.monotonic()
+        closing = False
+
+        while not closing:
+
+            # Wait for at least one message, then take everything else
+            # that is already in the queue as part of the same batch.
+            try:
+                batch = [self._queue.get(timeout = self.flush_interval)]
+            except queue.Empty:
+                batch = []
+
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if _CLOSE in batch:
+                closing = True
+                batch = batch[:batch.index(_CLOSE)]
+
+            if batch:
+                # How far behind the socket the writer is: the time the
+                # oldest message of the batch has spent in the queue,
+                # and how many messages are still waiting after it.
+                if metrics.ENABLED:
+                    metrics.gauge("writer.lag_seconds", time.time() - batch[0][0])
+                    metrics.gauge("writer.queue_depth", self._queue.qsize())
+                    metrics.count("writer.messages", len(batch))
+
+                # Demojize the whole batch in one call instead of once
+                # per message; the timestamps contain no emojis. The
+                # messages are kept apart for rotating the file by size.
+                text = demojize("".join(f"{self._timestamp(received)} ;;; {message}\n{_SEPARATOR}"
+                                        for received, message in batch))
+                entries = text.split(_SEPARATOR)[:-1]
+
+                buffer.extend(entries)
+                buffered += len(text) - len(entries)
+                self.n_messages += len(batch)
+
+            if buffered >= self.buffer_size or closing or \
+               time.monotonic() - last_flush >= self.flush_interval:
+
+                if buffer:
+                    with metrics.timer("writer.write"):
+                        self._write(buffer)
+
+                buffer = []
+                buffered = 0
+                last_flush = time.monotonic()
+
+        self._file.close()
+
+
+
+    # Formats the timestamp of a message, reusing the
+    # last one if it was received in the same second.
+    def _timestamp(self, received):
+
+        second = int(received)
+
+        if second != self._second:
+            self._second = second
+            self._stamp = time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime(second))
+
+        if self.milliseconds:
+            return f"{self._stamp}.{int((received - second) * 1000):03d}"
+
+        return self._stamp
+
+
+
+    # Writes out a list of messages, starting a new file whenever
+    # the next message would take the current one over max_bytes.
+    def _write(self, entries):
+
+        if self._needs_rotation():
+            self._rotate()
+
+        chunk = []
+        chunk_size = 0
+
+        for entry in entries:
+
+            if self.max_bytes is not None and self._file_size + chunk_size > 0 and \
+               self._file_size + chunk_size + len(entry) > self.max_bytes:
+
+                self._file.write("".join(chunk))
+                self._rotate()
+                chunk = []
+                chunk_size = 0
+
+            chunk.append(entry)
+            chunk_size += len(entry)
+
+        self._file.write("".join(chunk))
+        self._file.flush()
+        self._file_size += chunk_size
+
+
+
+    def _rotate(self):
+        self._file.close()
+        self._open_next_file()
+
+
+
+    def _needs_rotation(self):
+
+        if self.max_bytes is not None and self._file_size >= self.max_bytes:
+            return True
+
+        if self.rotate_minutes is not None and \
+           time.monotonic() - self._file_opened >= self.rotate_minutes * 60:
+            return True
+
+        return False
+
+
+
+    def _open_next_file(self):
+
+        root, ext = os.path.splitext(self.path)
+
+        if self.max_bytes is not None or self.rotate_minutes is not None:
+            path = f"{root}_{len(self.paths):03d}{ext}"
+        else:
+            path = self.path
+
+        path += COMPRESSION_SUFFIXES[self.compression]
+
+        self._file = open_log(path, "w")
+        self._file_size = 0
+        self._file_opened = time.monotonic()
+        self.paths.append(path)
+
+
+
+# Opens a log file as text, compressed or not depending on its extension.
+# Used for both writing the logs here and reading them in twitch_chat_format.
+def open_log(path, mode = "r"):
+
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding = "utf-8")
+
+    if path.endswith(".zst"):
+        import zstandard
+
+        raw = open(path, mode + "b")
+
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd = True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd = True)
+
+        return io.TextIOWrapper(stream, encoding = "utf-8")
+
+    return open(path, mode, encoding = "utf-8")
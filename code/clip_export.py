@@ -0,0 +1,346 @@
+###
+#
+# Filename: clip_export.py
+# Author: Derek Steffan
+#
+# This file contains a faster way of cutting the highlight reel out of
+# a VOD than the moviepy code in 04_video_editing.ipynb, which decodes
+# the whole VOD into Python and encodes every frame of the reel again.
+#
+# Here every clip is cut out of the VOD by ffmpeg with a stream copy,
+# i.e. the compressed video and audio are copied over as they are, and
+# the clips are then joined with ffmpeg's concat demuxer, also without
+# re-encoding. A stream copy can only start on a keyframe, so by default
+# every clip is moved back to start on the keyframe before it (at most
+# a couple of seconds early for a typical Twitch VOD). With exact = True,
+# the bit of every clip before its first keyframe is re-encoded instead,
+# and only the rest of the clip is copied. The clips are cut in parallel.
+#
+# ffmpeg has to be installed and on the PATH (or passed as 'ffmpeg').
+# Exact cuts also need ffprobe: the re-encoded parts can only be joined
+# to the copied ones if they are encoded the same way, so the profile,
+# level, pixel format, frame rate and timescale of the video and the
+# sample rate and channels of the audio are read from the VOD with
+# ffprobe and used for the re-encode. That is only possible with libx264
+# and aac, so exact cuts refuse anything but H.264 video with AAC audio
+# (which is what Twitch serves).
+#
+# Even then, the reel is an MP4 and only holds one SPS and PPS (the
+# parameter sets every frame is decoded with), from its first segment.
+# Unless libx264 happens to write exactly the same ones as the encoder
+# of the VOD, the copied parts would be decoded with the wrong ones, so
+# a short test encode is compared with the VOD first, and if they differ
+# every clip is re-encoded whole instead (slower, but still exact).
+#
+# Run it from the code directory with e.g.:
+# python clip_export.py ../assets/video/vod.mp4 ../data/clips/admiralbulldog_4_30_stdev.csv reel.mp4
+#
+###
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import tempfile
+import warnings
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+# Seconds to seek past a keyframe when stream copying from it.
+_SEEK_EPSILON = 1e-3
+
+# ffprobe's H.264 profiles and the matching -profile:v of libx264.
+_X264_PROFILES = {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main",
+                  "High": "high", "High 10": "high10", "High 4:2:2": "high422",
+                  "High 4:4:4 Predictive": "high444"}
+
+
+
+# Description of arguments:
+
+# video_path
+# The VOD to cut the clips out of.
+
+# clips
+# (n, 2) array of the start and end of every clip in seconds, like
+# the output of highlighter.get_highlights_index, or a dataframe with
+# "start_seconds" and "end_seconds" columns like the ones written to
+# data/clips by highlight_pipeline.py.
+
+# output_path
+# Where to write the highlight reel.
+
+# offset
+# Seconds to add to every clip, for clips that are relative to a part
+# of the VOD, e.g. the start of the game in 04_video_editing.ipynb.
+
+# exact
+# Re-encode the start of every clip up to its first keyframe so that it
+# starts exactly where it should, instead of on the keyframe before.
+
+# n_jobs
+# Number of ffmpeg processes to run at once, or None for every core.
+
+# Returns the (start, end, copy) of every segment that was cut.
+def export_reel(video_path, clips, output_path, offset = 0, exact = False,
+                n_jobs = None, ffmpeg = "ffmpeg", ffprobe = "ffprobe"):
+
+    clips = _clip_array(clips) + offset
+
+    if len(clips) == 0:
+        raise ValueError("there are no clips to export")
+
+    copy_options = ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+    encode_options = None
+
+    # Checked before cutting anything, so that a VOD that cannot be
+    # cut exactly fails right away.
+    if exact:
+        parameters = stream_parameters(video_path, ffprobe)
+        encode_options = _encode_options(parameters)
+        copy_options += ["-video_track_timescale", _timescale(parameters["video"])]
+
+    keyframes = keyframe_times(video_path, ffmpeg)
+    segments = cut_plan(clips, keyframes, exact)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        if exact and any(copy for _, _, copy in segments):
+
+            test_path = os.path.join(temp_dir, "test_encode.mp4")
+            _cut(video_path, 0.0, 0.1, False, test_path, ffmpeg, encode_options)
+
+            if parameter_sets(test_path, ffmpeg) != parameter_sets(video_path, ffmpeg):
+                warnings.warn("libx264 cannot write the same SPS and PPS as the VOD, "
+                              "so every clip is re-encoded whole", RuntimeWarning)
+                segments = [(float(start), float(end), False) for start, end in clips]
+
+        paths = [os.path.join(temp_dir, f"segment_{i:04d}.mp4") for i in range(len(segments))]
+
+        # ffmpeg does the work, so threads are enough to run many at once.
+        with ThreadPoolExecutor(max_workers = n_jobs or os.cpu_count()) as pool:
+
+            futures = [pool.submit(_cut, video_path, start, end, copy, path, ffmpeg,
+                                   copy_options if copy else encode_options)
+                       for (start, end, copy), path in zip(segments, paths)]
+
+            for future in futures:
+                future.result()
+
+        list_path = os.path.join(temp_dir, "segments.txt")
+
+        with open(list_path, "w", encoding = "utf-8") as segment_list:
+            segment_list.writelines(f"file '{path}'\n" for path in paths)
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok = True)
+
+        _run([ffmpeg, "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+              "-c", "copy", "-movflags", "+faststart", output_path])
+
+    return segments
+
+
+
+# Times in seconds of every keyframe of the first video stream. Only
+# the keyframes are decoded, which is quick even for a long VOD.
+def keyframe_times(video_path, ffmpeg = "ffmpeg"):
+
+    output = _run([ffmpeg, "-hide_banner", "-skip_frame", "nokey", "-i", video_path,
+                   "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"])
+
+    times = re.findall(r"pts_time:\s*([0-9.]+)", output)
+
+    return np.unique(np.array(times, dtype = float))
+
+
+
+# The SPS and PPS NAL units of the first video stream (which has to be
+# H.264), as a sorted list of bytes, read from its first keyframe.
+def parameter_sets(video_path, ffmpeg = "ffmpeg"):
+
+    result = subprocess.run([ffmpeg, "-v", "error", "-i", video_path, "-map", "0:v:0",
+                             "-c:v", "copy", "-bsf:v", "h264_mp4toannexb", "-frames:v", "1",
+                             "-f", "h264", "-"], capture_output = True)
+
+    if result.returncode != 0:
+        raise RuntimeError(f"{ffmpeg} failed:\n{result.stderr.decode('utf-8', 'replace')[-2000:]}")
+
+    # Every NAL unit starts after a 00 00 01 start code; a four byte start
+    # code leaves a zero at the end of the unit before it. NAL unit type
+    # 7 is an SPS and 8 is a PPS.
+    units = [unit.rstrip(b"\x00") for unit in result.stdout.split(b"\x00\x00\x01")]
+
+    return sorted(unit for unit in units if unit and unit[0] & 0x1f in (7, 8))
+
+
+
+# The ffprobe fields of the first video and audio streams of a video,
+# as {"video": {...}, "audio": {...}}; "audio" is None without audio.
+def stream_parameters(video_path, ffprobe = "ffprobe"):
+
+    result = subprocess.run([ffprobe, "-v", "error", "-of", "json", "-show_entries",
+                             "stream=codec_type,codec_name,profile,level,pix_fmt,"
+                             "r_frame_rate,time_base,sample_rate,channels", video_path],
+                            capture_output = True, encoding = "utf-8", errors = "replace")
+
+    if result.returncode != 0:
+        raise RuntimeError(f"{ffprobe} failed:\n{result.stderr[-2000:]}")
+
+    streams = json.loads(result.stdout).get("streams", [])
+
+    return {kind: next((stream for stream in streams if stream.get("codec_type") == kind), None)
+            for kind in ("video", "audio")}
+
+
+
+# Turns the clips into the segments to cut, as (start, end, copy)
+# tuples in the order they go in the reel. 'copy' is False for the
+# segments that have to be re-encoded.
+def cut_plan(clips, keyframes, exact = False):
+
+    keyframes = np.asarray(keyframes, dtype = float)
+    segments = []
+
+    for start, end in _clip_array(clips):
+
+        # The first keyframe at or after the start, and the last one at or
+        # before it (a tiny tolerance avoids re-encoding for rounding).
+        i = np.searchsorted(keyframes, start - 1e-3)
+        after = keyframes[i] if i < len(keyframes) else np.inf
+        before = after if after - start <= 1e-3 else keyframes[max(i - 1, 0)]
+
+        if not exact:
+            segments.append((before, end, True))
+
+        elif after >= end:
+            # The whole clip is within one group of pictures.
+            segments.append((start, end, False))
+
+        else:
+            if after - start > 1e-3:
+                segments.append((start, after, False))
+
+            segments.append((after, end, True))
+
+    return [(float(start), float(end), copy) for start, end, copy in segments]
+
+
+
+# Creates a short test video with a keyframe every 'gop' frames and a
+# tone on the audio track, for trying out export_reel without a VOD.
+def make_test_video(path, seconds = 60, fps = 30, gop = 60, ffmpeg = "ffmpeg"):
+
+    _run([ffmpeg, "-y", "-f", "lavfi", "-i", f"testsrc=duration={seconds}:size=320x240:rate={fps}",
+          "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+          "-c:v", "libx264", "-pix_fmt", "yuv420p", "-g", str(gop), "-keyint_min", str(gop),
+          "-sc_threshold", "0", "-c:a", "aac", "-shortest", path])
+
+    return path
+
+
+
+# Cuts one segment out of the video. Seeking before the input makes
+# ffmpeg jump straight to the right place instead of reading up to it.
+def _cut(video_path, start, end, copy, path, ffmpeg = "ffmpeg", options = None):
+
+    if options is None:
+        options = ["-c", "copy", "-avoid_negative_ts", "make_zero"] if copy else \
+                  ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac"]
+
+    # A stream copy starts on the last keyframe at or before the seek
+    # time. The keyframe times are rounded, so seeking to one exactly
+    # could land on the keyframe before it and repeat a whole group of
+    # pictures; seeking a hair past it avoids that.
+    seek = start + _SEEK_EPSILON if copy else start
+
+    _run([ffmpeg, "-y", "-ss", f"{seek:.6f}", "-i", video_path, "-t", f"{end - seek:.6f}",
+          "-map", "0:v:0", "-map", "0:a?"] + options + [path])
+
+
+
+# Options for re-encoding part of a clip the same way as the VOD, from
+# stream_parameters, or a ValueError if libx264 and aac cannot match it.
+def _encode_options(parameters):
+
+    video = parameters["video"]
+    audio = parameters["audio"]
+
+    if video is None or video.get("codec_name") != "h264":
+        raise ValueError("exact cuts need H.264 video to match with libx264")
+
+    profile = _X264_PROFILES.get(video.get("profile"))
+
+    if profile is None or not video.get("level") or not video.get("pix_fmt"):
+        raise ValueError(f"exact cuts cannot match the H.264 profile {video.get('profile')!r}, "
+                         f"level {video.get('level')!r} and pixel format {video.get('pix_fmt')!r}")
+
+    options = ["-c:v", "libx264", "-profile:v", profile, "-level:v", f"{int(video['level']) / 10:.1f}",
+               "-pix_fmt", video["pix_fmt"], "-r", video["r_frame_rate"],
+               "-video_track_timescale", _timescale(video)]
+
+    if audio is not None:
+
+        if audio.get("codec_name") != "aac" or audio.get("profile") not in (None, "LC"):
+            raise ValueError(f"exact cuts need AAC-LC audio to match with aac, "
+                             f"not {audio.get('codec_name')!r} {audio.get('profile')!r}")
+
+        options += ["-c:a", "aac", "-ar", str(audio["sample_rate"]), "-ac", str(audio["channels"])]
+
+    return options
+
+
+
+# Ticks per second of a stream, e.g. "15360" for a time_base of "1/15360".
+def _timescale(stream):
+    return stream["time_base"].split("/")[1]
+
+
+
+# Runs ffmpeg, returning what it wrote to stderr (where it
+# writes its logs) and raising an error if it failed.
+def _run(command):
+
+    result = subprocess.run(command, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE,
+                            encoding = "utf-8", errors = "replace")
+
+    if result.returncode != 0:
+        raise RuntimeError(f"{command[0]} failed:\n{result.stderr[-2000:]}")
+
+    return result.stderr
+
+
+
+def _clip_array(clips):
+
+    if isinstance(clips, pd.DataFrame):
+        clips = clips[["start_seconds", "end_seconds"]]
+
+    clips = np.asarray(clips, dtype = float).reshape(-1, 2)
+
+    # A clip cannot start before the start of the video.
+    return np.column_stack([np.maximum(clips[:, 0], 0), clips[:, 1]])
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Cut a highlight reel out of a VOD with ffmpeg.")
+    parser.add_argument("video")
+    parser.add_argument("clips", help = ".csv file from data/clips with start_seconds and end_seconds")
+    parser.add_argument("output")
+    parser.add_argument("--offset", type = float, default = 0,
+                        help = "seconds to add to every clip, e.g. the start of the game in the VOD")
+    parser.add_argument("--exact", action = "store_true", help = "re-encode up to the first keyframe of every clip")
+    parser.add_argument("--jobs", type = int, default = None, help = "number of ffmpeg processes")
+    parser.add_argument("--ffmpeg", default = "ffmpeg")
+    parser.add_argument("--ffprobe", default = "ffprobe", help = "only needed with --exact")
+    args = parser.parse_args()
+
+    segments = export_reel(args.video, pd.read_csv(args.clips), args.output, args.offset,
+                           args.exact, args.jobs, args.ffmpeg, args.ffprobe)
+
+    print(f"{len(segments)} segments written to {args.output}")
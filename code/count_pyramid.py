@@ -0,0 +1,183 @@
+###
+#
+# Filename: count_pyramid.py
+# Author: Derek Steffan
+#
+# This file contains a "pyramid" of message counts for one broadcast at
+# several bin widths at once (by default 100 ms, 1 s, 10 s and 1 min),
+# so that the highlighters and plots can pick whichever resolution suits
+# them without counting the messages all over again.
+#
+# The messages are only binned once, at the finest width, and every
+# coarser level is made by adding up the bins of the finest one. Every
+# level is the same series messages_per_second returns for that width.
+# The sub-second levels only make sense for logs written with
+# milliseconds (see chat_log_writer.py); for older logs every message
+# falls at the start of its second.
+#
+# For plotting, window() picks the finest level that shows a given
+# stretch of the broadcast in at most a few thousand points, which keeps
+# zooming in and out of a whole day of chat interactive in a notebook.
+#
+###
+
+import os
+import numpy as np
+import pandas as pd
+import chat_cache
+import twitch_chat_format as tcf
+
+
+
+DEFAULT_RESOLUTIONS = ("100ms", "1s", "10s", "1min")
+
+
+
+class CountPyramid:
+
+    # levels
+    # Dictionary of bin width (as a pd.Timedelta) to the series of counts.
+    def __init__(self, levels):
+
+        self.levels = dict(sorted(levels.items()))
+
+
+
+    # Builds the pyramid from a dataframe from twitch_chat_format.
+    # Every resolution has to be a whole multiple of the next finer one
+    # (e.g. 1s, 10s, 1min, but not 1s, 4s, 6s), so that the bins of every
+    # level start on a multiple of its own width.
+    @classmethod
+    def from_messages(cls, df, resolutions = DEFAULT_RESOLUTIONS):
+
+        widths = sorted(pd.Timedelta(resolution).value for resolution in resolutions)
+        finest = widths[0]
+
+        if finest <= 0:
+            raise ValueError("resolutions must be positive amounts of time")
+
+        if any(coarser % finer for finer, coarser in zip(widths, widths[1:])):
+            raise ValueError("every resolution must be a multiple of the next finer one")
+
+        times = df.index.values.astype("datetime64[ns]").view("int64")
+        unit = df.index.unit
+
+        # Every level is aligned to its own width, like messages_per_second,
+        # so the finest bins start from a multiple of the coarsest width.
+        base = times.min() // widths[-1] * widths[-1]
+        counts = np.bincount((times - base) // finest)
+
+        levels = {}
+
+        for width in widths:
+
+            factor = width // finest
+
+            # Add up every 'factor' of the finest bins.
+            padded = np.zeros(-(-len(counts) // factor) * factor, dtype = counts.dtype)
+            padded[:len(counts)] = counts
+            level = padded.reshape(-1, factor).sum(axis = 1)
+
+            # Same bins as messages_per_second: from the one holding the
+            # first message to the one holding the last, with the very
+            # first bin left out.
+            first = (times.min() - base) // width
+            last = (times.max() - base) // width
+
+            index = pd.date_range(start = pd.Timestamp(base + (first + 1) * width),
+                                  periods = last - first, freq = pd.Timedelta(width), unit = unit)
+
+            levels[pd.Timedelta(width)] = pd.Series(level[first + 1:last + 1], index = index)
+
+        return cls(levels)
+
+
+
+    @property
+    def resolutions(self):
+        return list(self.levels)
+
+
+
+    # The counts at one resolution, e.g. pyramid.level("10s").
+    def level(self, resolution):
+
+        width = pd.Timedelta(resolution)
+
+        if width not in self.levels:
+            raise KeyError(f"no level with a width of {width}; the widths are {self.resolutions}")
+
+        return self.levels[width]
+
+
+
+    # The counts between 'start' and 'end' at the finest resolution that
+    # gives at most 'max_points' bins, or the coarsest one if none does.
+    # The counts are divided by the width in seconds with 'per_second',
+    # so that every level is on the same scale when plotted.
+    def window(self, start = None, end = None, max_points = 2000, per_second = False):
+
+        for width, counts in self.levels.items():
+
+            counts = counts.loc[start:end]
+
+            if len(counts) <= max_points:
+                break
+
+        if per_second:
+            counts = counts / width.total_seconds()
+
+        return counts
+
+
+
+    # Saves every level to the Arrow cache format of chat_cache.py,
+    # with 'path' being the path without the resolution and extension.
+    def save(self, path):
+
+        for width, counts in self.levels.items():
+            chat_cache._write_frame(counts, f"{path}_{_width_name(width)}.arrow")
+
+
+
+    @classmethod
+    def load(cls, path, resolutions = DEFAULT_RESOLUTIONS):
+
+        return cls({pd.Timedelta(resolution):
+                    chat_cache._read_frame(f"{path}_{_width_name(pd.Timedelta(resolution))}.arrow")
+                    for resolution in resolutions})
+
+
+
+# Returns the CountPyramid for the .log file at 'path', building it from
+# the cached formatted chat (after removing the messages of 'bot_name')
+# and saving it to the cache the first time.
+def cached_count_pyramid(path, bot_name = None, cache_dir = chat_cache.CACHE_DIR,
+                         resolutions = DEFAULT_RESOLUTIONS):
+
+    resolutions = tuple(resolutions)
+
+    cache_path = chat_cache._cache_path(path, "pyramid", {"bot_name": bot_name,
+                                                          "resolutions": resolutions}, cache_dir)
+    cache_path = os.path.splitext(cache_path)[0]
+
+    widths = [pd.Timedelta(resolution) for resolution in resolutions]
+
+    if all(os.path.exists(f"{cache_path}_{_width_name(width)}.arrow") for width in widths):
+        return CountPyramid.load(cache_path, resolutions)
+
+    df = chat_cache.cached_twitch_chat_format(path, cache_dir = cache_dir)
+
+    if bot_name is not None:
+        df = tcf.filter_bot_messages(df, bot_name)
+
+    pyramid = CountPyramid.from_messages(df, resolutions)
+    pyramid.save(cache_path)
+
+    return pyramid
+
+
+
+# pd.Timedelta("100ms") -> "100ms", for the names of the cache files.
+def _width_name(width):
+    return f"{width.value // 1_000_000}ms"
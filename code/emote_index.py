@@ -0,0 +1,179 @@
+###
+#
+# Filename: emote_index.py
+# Author: Derek Steffan
+#
+# This file contains an index of how many times every word (in practice
+# mostly emotes like LUL, PogChamp or WutFace) was sent in every second
+# of a broadcast, built once from the output of twitch_chat_format.
+#
+# The counts are kept in a sparse matrix with one row per second and
+# one column per word, so questions like "which emotes were spammed the
+# most during this game" or "when did chat spam WutFace" can be answered
+# without going through every message again. It is saved next to the
+# formatted chat in the cache from chat_cache.py.
+#
+# Words are split on whitespace and kept case sensitive, since emotes
+# are case sensitive (e.g. "LUL" and "lul" are not the same).
+#
+###
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import chat_cache
+import highlighter as hl
+
+
+
+class EmoteIndex:
+
+    # matrix
+    # Sparse (seconds x words) matrix of counts.
+
+    # tokens
+    # The word for every column of the matrix.
+
+    # start, freq
+    # Time of the first row and the time between rows.
+    def __init__(self, matrix, tokens, start, freq = "1s"):
+
+        self.matrix = scipy.sparse.csr_matrix(matrix)
+        self.tokens = np.asarray(tokens, dtype = object)
+        self.start = pd.Timestamp(start)
+        self.freq = pd.Timedelta(freq)
+
+        self.token_ids = {token: i for i, token in enumerate(self.tokens)}
+
+        # Time of every row.
+        self.index = pd.date_range(self.start, periods = self.matrix.shape[0], freq = self.freq)
+
+        # Column-wise copy for pulling out the series of one word quickly.
+        self._columns = self.matrix.tocsc()
+
+
+
+    # Builds the index from a dataframe from twitch_chat_format. Words
+    # sent fewer than 'min_count' times in total are left out.
+    @classmethod
+    def from_messages(cls, df, freq = "1s", min_count = 1):
+
+        freq = pd.Timedelta(freq)
+
+        words = df["message"].str.split().explode().dropna()
+
+        times = words.index.values.astype("datetime64[ns]").view("int64")
+        origin = times.min() // freq.value * freq.value if len(times) else 0
+        rows = (times - origin) // freq.value
+
+        cols, tokens = pd.factorize(words.to_numpy())
+
+        n_rows = int(rows.max()) + 1 if len(rows) else 0
+
+        # Duplicate (row, col) pairs are added together.
+        matrix = scipy.sparse.coo_matrix((np.ones(len(rows), dtype = np.int32), (rows, cols)),
+                                         shape = (n_rows, len(tokens))).tocsr()
+
+        if min_count > 1:
+            keep = np.flatnonzero(np.asarray(matrix.sum(axis = 0)).ravel() >= min_count)
+            matrix = matrix[:, keep]
+            tokens = tokens[keep]
+
+        return cls(matrix, tokens, pd.Timestamp(origin), freq)
+
+
+
+    # Number of times 'token' was sent in every second.
+    def series(self, token):
+
+        col = self.token_ids.get(token)
+
+        if col is None:
+            counts = np.zeros(self.matrix.shape[0], dtype = np.int64)
+        else:
+            counts = self._columns[:, col].toarray().ravel()
+
+        return pd.Series(counts, index = self.index, name = token)
+
+
+
+    # The 'k' most sent words between 'start' and 'end' (inclusive),
+    # as a series of counts sorted from most to least.
+    def top_k(self, start = None, end = None, k = 10):
+
+        first, last = self._rows(start, end)
+
+        counts = np.asarray(self.matrix[first:last].sum(axis = 0)).ravel()
+
+        k = min(k, len(counts))
+        top = np.argpartition(-counts, k - 1)[:k] if k else np.array([], dtype = int)
+        top = top[np.argsort(-counts[top], kind = "stable")]
+
+        return pd.Series(counts[top], index = self.tokens[top])
+
+
+
+    # Flags the highlights of one word the same way highlight_by_stdev
+    # flags the highlights of the total messages per second.
+    def highlight(self, token, threshold = 4, roll = 5):
+
+        return hl.highlight_by_stdev(self.series(token).to_frame("mps"), threshold, roll)
+
+
+
+    # Saves the index as a .npz file for the matrix and a .json file
+    # for the words, with 'path' being the path without extension.
+    def save(self, path):
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+
+        scipy.sparse.save_npz(f"{path}.npz", self.matrix)
+
+        with open(f"{path}.json", "w", encoding = "utf-8") as output:
+            json.dump({"tokens": list(self.tokens),
+                       "start": self.start.isoformat(),
+                       "freq": str(self.freq)}, output)
+
+
+
+    @classmethod
+    def load(cls, path):
+
+        matrix = scipy.sparse.load_npz(f"{path}.npz")
+
+        with open(f"{path}.json", encoding = "utf-8") as saved:
+            meta = json.load(saved)
+
+        return cls(matrix, meta["tokens"], meta["start"], meta["freq"])
+
+
+
+    # Converts a start and end time into a range of rows.
+    def _rows(self, start, end):
+
+        first = 0 if start is None else (pd.Timestamp(start) - self.start) // self.freq
+        last = self.matrix.shape[0] if end is None else (pd.Timestamp(end) - self.start) // self.freq + 1
+
+        return max(int(first), 0), max(int(last), 0)
+
+
+
+# Returns the EmoteIndex for the .log file at 'path', building it from
+# the cached formatted chat and saving it to the cache the first time.
+def cached_emote_index(path, cache_dir = chat_cache.CACHE_DIR, freq = "1s", min_count = 1):
+
+    cache_path = chat_cache._cache_path(path, "emotes", {"freq": freq, "min_count": min_count},
+                                        cache_dir)
+    cache_path = os.path.splitext(cache_path)[0]
+
+    if os.path.exists(f"{cache_path}.npz") and os.path.exists(f"{cache_path}.json"):
+        return EmoteIndex.load(cache_path)
+
+    df = chat_cache.cached_twitch_chat_format(path, cache_dir = cache_dir)
+
+    index = EmoteIndex.from_messages(df, freq = freq, min_count = min_count)
+    index.save(cache_path)
+
+    return index
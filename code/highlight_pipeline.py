@@ -0,0 +1,263 @@
+###
+#
+# Filename: highlight_pipeline.py
+# Author: Derek Steffan
+#
+# This script runs the whole pipeline from the notebooks, going from
+# a .log file to the start and end times of the highlight clips, for
+# any number of broadcasts at once. Every broadcast is handled by its
+# own process, and broadcasts whose outputs are already up to date
+# are skipped, so a whole archive of logs can be reprocessed overnight.
+#
+# For every log, e.g. data/logs/chat_admiralbulldog_4_30.log, it writes
+#
+# data/formatted/admiralbulldog_4_30.csv          formatted messages
+# data/formatted/admiralbulldog_4_30_mps.csv      messages per second
+# data/highlighted/admiralbulldog_4_30_<method>.csv   highlight flags
+# data/clips/admiralbulldog_4_30_<method>.csv     start and end of every clip
+#
+# Run it from the code directory with e.g.:
+# python highlight_pipeline.py "../data/logs/*.log" --bot-name admiralbullbot
+#
+###
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import chat_cache
+import highlighter as hl
+import twitch_chat_format as tcf
+
+
+
+# Description of arguments:
+
+# log_paths
+# List of .log files to process.
+
+# output_dir
+# Directory holding the formatted/, highlighted/ and clips/ directories.
+
+# bot_names
+# Usernames of chat bots whose messages (and commands) are removed.
+
+# method
+# "stdev" for highlight_by_stdev or "probability" for highlight_by_probability.
+
+# threshold, sensitivity, roll, before_time, after_time
+# Same as the arguments of the functions in highlighter.py.
+
+# n_jobs
+# Number of processes to use, or None for every core.
+
+# force
+# Process every log, even if its outputs are up to date.
+
+# Returns a dictionary of stream name to the time taken by every stage,
+# or None for the streams that were skipped, and a dictionary of stream
+# name to the error for the streams that failed. A stream that fails
+# (e.g. a log without any chat messages) does not stop the others.
+def run_pipeline(log_paths, output_dir = "../data", bot_names = (), method = "stdev",
+                 threshold = 4, sensitivity = 0.05, roll = 5, before_time = 15,
+                 after_time = 15, n_jobs = None, force = False):
+
+    if method not in ("stdev", "probability"):
+        raise ValueError("method must be either 'stdev' or 'probability'")
+
+    settings = {"bot_names": sorted(bot_names),
+                "method": method,
+                "threshold": threshold if method == "stdev" else None,
+                "sensitivity": sensitivity if method == "probability" else None,
+                "roll": roll,
+                "before_time": before_time,
+                "after_time": after_time}
+
+    timings = {}
+    failures = {}
+
+    with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+
+        futures = {pool.submit(process_stream, path, output_dir, settings, force): path
+                   for path in log_paths}
+
+        for future in as_completed(futures):
+
+            try:
+                name, stream_timings = future.result()
+
+            except Exception as error:
+                name = stream_name(futures[future])
+                failures[name] = f"{type(error).__name__}: {error}"
+                print(f"{name}: failed, {failures[name]}")
+                continue
+
+            timings[name] = stream_timings
+
+            if stream_timings is None:
+                print(f"{name}: up to date, skipped")
+            else:
+                stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stream_timings.items())
+                print(f"{name}: {stages}")
+
+    return timings, failures
+
+
+
+# Runs every stage of the pipeline for one .log file, returning the
+# name of the stream and the time taken by each stage in seconds.
+def process_stream(path, output_dir, settings, force = False):
+
+    name = stream_name(path)
+    outputs = _output_paths(name, output_dir, settings["method"])
+    manifest_path = os.path.join(output_dir, "pipeline", f"{name}_{settings['method']}.json")
+    manifest = _manifest(path, settings)
+
+    if not force and _up_to_date(manifest_path, manifest, outputs.values()):
+        return name, None
+
+    for output in outputs.values():
+        os.makedirs(os.path.dirname(output), exist_ok = True)
+
+    timings = {}
+    stage_start = time.perf_counter()
+
+    def checkpoint(stage):
+        nonlocal stage_start
+        now = time.perf_counter()
+        timings[stage] = now - stage_start
+        stage_start = now
+
+    # Parsing goes through the cache, so changing only the
+    # highlight settings does not parse the log all over again.
+    df = chat_cache.cached_twitch_chat_format(path, cache_dir = os.path.join(output_dir, "cache"))
+    checkpoint("parse")
+
+    if settings["bot_names"]:
+        df = tcf.filter_bot_messages(df, settings["bot_names"])
+    checkpoint("filter")
+
+    mps = tcf.messages_per_second(df)
+    checkpoint("mps")
+
+    time_series = mps.to_frame("mps")
+
+    if settings["method"] == "stdev":
+        time_series["highlight"] = hl.highlight_by_stdev(time_series, settings["threshold"], settings["roll"])
+    else:
+        time_series["highlight"] = hl.highlight_by_probability(time_series, settings["sensitivity"], settings["roll"])
+    checkpoint("highlight")
+
+    clips = hl.highlight_intervals(time_series, settings["before_time"], settings["after_time"])
+
+    # Seconds from the start of the series as well, which is what
+    # moviepy wants (see get_highlights_index).
+    first = time_series.index.min()
+    clips = pd.DataFrame({"start": clips[:, 0], "end": clips[:, 1]})
+    clips["start_seconds"] = (clips["start"] - first).dt.total_seconds()
+    clips["end_seconds"] = (clips["end"] - first).dt.total_seconds()
+    checkpoint("clips")
+
+    df.to_csv(outputs["formatted"], index = True)
+    mps.to_csv(outputs["mps"], index = True, header = True)
+    time_series[["highlight"]].to_csv(outputs["highlighted"])
+    clips.to_csv(outputs["clips"], index = False)
+    checkpoint("write")
+
+    # Written last, so that an interrupted run is never taken as up to date.
+    os.makedirs(os.path.dirname(manifest_path), exist_ok = True)
+
+    with open(manifest_path, "w", encoding = "utf-8") as output:
+        json.dump(manifest, output, indent = 2)
+
+    return name, timings
+
+
+
+# "chat_admiralbulldog_4_30.log" -> "admiralbulldog_4_30",
+# matching the names of the files in data/formatted.
+def stream_name(path):
+
+    name = os.path.basename(path).split(".")[0]
+
+    return name[len("chat_"):] if name.startswith("chat_") else name
+
+
+
+def _output_paths(name, output_dir, method):
+
+    return {"formatted": os.path.join(output_dir, "formatted", f"{name}.csv"),
+            "mps": os.path.join(output_dir, "formatted", f"{name}_mps.csv"),
+            "highlighted": os.path.join(output_dir, "highlighted", f"{name}_{method}.csv"),
+            "clips": os.path.join(output_dir, "clips", f"{name}_{method}.csv")}
+
+
+
+# Everything that the outputs of one stream depend on.
+def _manifest(path, settings):
+
+    stat = os.stat(path)
+
+    return {"log": os.path.abspath(path),
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "parser_version": tcf.PARSER_VERSION,
+            "highlighter_version": hl.HIGHLIGHTER_VERSION,
+            "settings": settings}
+
+
+
+def _up_to_date(manifest_path, manifest, outputs):
+
+    if not os.path.exists(manifest_path) or not all(os.path.exists(output) for output in outputs):
+        return False
+
+    with open(manifest_path, encoding = "utf-8") as saved:
+        return json.load(saved) == manifest
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Find the highlights of many Twitch chat logs.")
+    parser.add_argument("logs", nargs = "+",
+                        help = ".log files, directories of .log files or glob patterns")
+    parser.add_argument("--output-dir", default = "../data")
+    parser.add_argument("--bot-name", action = "append", default = [], dest = "bot_names",
+                        help = "username of a chat bot to filter out; can be given more than once")
+    parser.add_argument("--method", choices = ["stdev", "probability"], default = "stdev")
+    parser.add_argument("--threshold", type = float, default = 4)
+    parser.add_argument("--sensitivity", type = float, default = 0.05)
+    parser.add_argument("--roll", type = int, default = 5)
+    parser.add_argument("--before-time", type = float, default = 15)
+    parser.add_argument("--after-time", type = float, default = 15)
+    parser.add_argument("--jobs", type = int, default = None, help = "number of processes")
+    parser.add_argument("--force", action = "store_true", help = "reprocess up to date logs")
+    args = parser.parse_args()
+
+    log_paths = []
+
+    for pattern in args.logs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.log")
+        log_paths.extend(sorted(glob.glob(pattern)))
+
+    then = time.perf_counter()
+
+    timings, failures = run_pipeline(log_paths, args.output_dir, args.bot_names, args.method,
+                                     args.threshold, args.sensitivity, args.roll, args.before_time,
+                                     args.after_time, args.jobs, args.force)
+
+    print(f"{len(log_paths)} logs in {time.perf_counter() - then:.1f} seconds")
+
+    if failures:
+        print(f"{len(failures)} failed:")
+
+        for name, error in sorted(failures.items()):
+            print(f"  {name}: {error}")
+
+        sys.exit(1)
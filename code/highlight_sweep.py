@@ -0,0 +1,130 @@
+###
+#
+# Filename: highlight_sweep.py
+# Author: Derek Steffan
+#
+# This file contains a function for trying out many different settings
+# of the highlighters in highlighter.py at once, returning how many
+# clips and how many minutes of video every setting would give. This
+# makes it quick to find the settings that give a highlight reel of a
+# certain length, instead of calling highlight_by_stdev and
+# highlight_by_probability over and over again by hand.
+#
+# The scaled data (and the Markov probabilities) are only calculated
+# once per rolling window, and every threshold for that window is
+# checked in one broadcasted comparison. Many broadcasts can be swept
+# at once across a pool of processes with sweep_streams.
+#
+###
+
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import highlighter as hl
+
+
+
+# Description of arguments:
+
+# df
+# Dataframe with an "mps" column, like the ones passed to highlighter.py.
+
+# rolls
+# Rolling window sizes to try.
+
+# thresholds
+# Thresholds to try for highlight_by_stdev.
+
+# sensitivities
+# Sensitivities to try for highlight_by_probability.
+
+# before_times, after_times
+# Clip padding to try, as in highlighter.get_highlights_index.
+
+# Returns a dataframe with one row per combination of settings, with
+# the number of seconds flagged, the number of distinct clips and the
+# total minutes of video.
+def sweep_highlights(df, rolls = (5,), thresholds = (3, 4, 5), sensitivities = (0.05,),
+                     before_times = (15,), after_times = (15,)):
+
+    index = df.index.to_numpy()
+    rows = []
+
+    for roll in rolls:
+
+        # The expensive part, done only once per rolling window.
+        z_score = hl._scale_data(df, roll)
+
+        # One row of flags per setting, all from one comparison each.
+        flags = {}
+
+        if len(thresholds):
+            stdev_flags = z_score.to_numpy()[None, :] >= np.asarray(thresholds, dtype = float)[:, None]
+            flags.update((("stdev", value), row) for value, row in zip(thresholds, stdev_flags))
+
+        if len(sensitivities):
+            mc_prob = hl._markov_probability(z_score).to_numpy()
+            prob_flags = mc_prob[None, :] <= np.asarray(sensitivities, dtype = float)[:, None]
+            flags.update((("probability", value), row) for value, row in zip(sensitivities, prob_flags))
+
+        for (method, value), flagged in flags.items():
+
+            # highlight_intervals expects the index sorted, which it is
+            # for every series made by messages_per_second.
+            timestamps = index[flagged]
+
+            for before_time, after_time in itertools.product(before_times, after_times):
+                before, after = _padding(timestamps, before_time, after_time)
+                clips = hl._merge_intervals(timestamps - before, timestamps + after)
+
+                rows.append({"method": method,
+                             "roll": roll,
+                             "value": value,
+                             "before_time": before_time,
+                             "after_time": after_time,
+                             "n_flagged": int(flagged.sum()),
+                             "n_clips": len(clips),
+                             "minutes": hl.clip_durations(clips).sum() / 60})
+
+    return pd.DataFrame(rows, columns = ["method", "roll", "value", "before_time", "after_time",
+                                         "n_flagged", "n_clips", "minutes"])
+
+
+
+# Runs sweep_highlights for several broadcasts in a pool of processes.
+# 'streams' is a dictionary of name to dataframe; the results are all
+# put into one dataframe with a "stream" column.
+def sweep_streams(streams, n_jobs = None, **grid):
+
+    names = list(streams)
+
+    with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+        futures = [pool.submit(sweep_highlights, streams[name], **grid) for name in names]
+        tables = [future.result() for future in futures]
+
+    for name, table in zip(names, tables):
+        table.insert(0, "stream", name)
+
+    return pd.concat(tables, ignore_index = True)
+
+
+
+# Returns the rows of a sweep sorted by how close their
+# total length is to the length of reel wanted.
+def closest_to_length(table, minutes):
+
+    order = (table["minutes"] - minutes).abs().sort_values(kind = "stable").index
+
+    return table.loc[order]
+
+
+
+# Converts the padding to timedeltas when the index is made of datetimes.
+def _padding(timestamps, before_time, after_time):
+
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        return (pd.Timedelta(seconds = before_time).to_timedelta64(),
+                pd.Timedelta(seconds = after_time).to_timedelta64())
+
+    return before_time, after_time
@@ -15,8 +15,15 @@
 
 import pandas as pd
 import numpy as np
-import scipy.stats
-from datetime import timedelta
+import metrics
+
+
+
+# Version of the scoring done here, part of what highlight_pipeline.py
+# checks to tell whether the highlights of a stream are up to date.
+# 2: the rolling stdev is scaled as (stdev - mean) / std; version 1
+# computed stdev - mean / std, which was not a z-score.
+HIGHLIGHTER_VERSION = 2
 
 
 
@@ -25,11 +32,20 @@ from datetime import timedelta
 # Standard deviation is chosen over rolling mean because 
 # stdev cannot be less than zero, and all I care about here
 # are the postive spikes in messages per second.
-def highlight_by_stdev(df, threshold = 4, roll = 5):
 
-    z_score = _scale_data(df, roll)
+# The rolling stdev is turned into a z-score, (stdev - mean) / std, so
+# the threshold is a number of standard deviations above normal. By
+# default the mean and std are those of the whole broadcast. Pass a
+# 'baseline' to score it against the channel's past broadcasts instead,
+# either as a (mean, stdev) tuple or as a baseline from baseline_store.py,
+# e.g. store.get("channel", roll), so that every second is scored on its
+# own and a threshold means the same thing for every broadcast.
+def highlight_by_stdev(df, threshold = 4, roll = 5, baseline = None):
 
-    return (z_score >= threshold).astype(int)
+    with metrics.timer("highlight.stdev"):
+        z_score = _scale_data(df, roll, baseline)
+
+        return (z_score >= threshold).astype(int)
 
 
 
@@ -44,40 +60,103 @@ def highlight_by_stdev(df, threshold = 4, roll = 5):
 # or decrease the length of the start and end times when 
 # calling the get_highlights_ funtions. 
 
-# Also note that this may take a minute or two to run.
-def highlight_by_probability(df, sensitivity = 0.05, roll = 5):
+# 'baseline' is the same as for highlight_by_stdev.
+def highlight_by_probability(df, sensitivity = 0.05, roll = 5, baseline = None):
+
+    with metrics.timer("highlight.probability"):
+        z_score = _scale_data(df, roll, baseline)
+
+        return (_markov_probability(z_score, baseline is not None) <= sensitivity).astype(int)
 
-    z_score = _scale_data(df, roll)
+
+
+# Calculates how likely every value of a scaled series is, given 
+# the value before it, using a normal distribution centered on the
+# previous value. This is the same as calling scipy.stats.norm(mu, sig)
+# .pdf(score) for every second, but as one array expression.
+def _markov_probability(z_score, standardized = False):
+
+    scores = z_score.to_numpy(dtype = float)
 
     # Initial mean and stdev for the normal distribution
-    # are based off the scaled data.
-    mu = z_score.mean()
-    sig = z_score.std()
+    # are based off the scaled data. Scores against a 
+    # baseline are already z-scores, i.e. mean 0 and stdev 1.
+    if standardized:
+        sig = 1.0
+        first_mu = 0.0
+    else:
+        sig = z_score.std()
+        first_mu = z_score.mean()
 
-    mc_prob = []
+    # Every other second is centered on the score before it. 
+    # NaN scores (e.g. the start of the rolling window) stay NaN,
+    # just like they do with scipy.
+    mu = np.empty_like(scores)
+    mu[:1] = first_mu
+    mu[1:] = scores[:-1]
 
-    # Iterate through every second and calculate how likely 
-    # the current "mps" is, given the last value of "mps"
-    # using a normal distribution.
-    for score in z_score:
-        mc_prob.append(scipy.stats.norm(mu, sig).pdf(score))
-        mu = score
-    
-    mc_prob = pd.Series(mc_prob, index = df.index)
+    # Normal pdf, written out in the same order of operations as scipy.
+    scaled = (scores - mu) / sig
+    mc_prob = np.exp(-scaled ** 2 / 2.0) / np.sqrt(2 * np.pi) / sig
 
-    return (mc_prob <= sensitivity).astype(int)
+    return pd.Series(mc_prob, index = z_score.index)
 
 
 
 # This function takes a time series that has been labeled as 
 # having distinct highlights and will return the start and
 # end times for generating a clip around that highlight, by 
-# defualt 15 seconds before and after, as a list of tuples.
+# defualt 15 seconds before and after, as an (n, 2) array
+# with one row of start and end times per clip.
 
 # If two consecutive clips' ending and start times overlap,
 # the two are "blobbed" together into one clip and the total 
 # time is extended to match the second clip's end time.
 
+# Works for both integer indexes, where before_time and after_time
+# are in the units of the index, and datetime indexes, where they
+# are in seconds. Every clip is found at once with NumPy: a new clip
+# starts wherever the start of a highlight comes after the furthest
+# end of every highlight before it.
+def highlight_intervals(df, before_time = 15, after_time = 15, target_col = "highlight"):
+
+    # Find the indices designated as a highlight
+    timestamps = np.sort(df.index[df[target_col].to_numpy() == 1].to_numpy())
+
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        before_time = pd.Timedelta(seconds = before_time).to_timedelta64()
+        after_time = pd.Timedelta(seconds = after_time).to_timedelta64()
+
+    return _merge_intervals(timestamps - before_time, timestamps + after_time)
+
+
+
+# Merges sorted (by start) intervals that overlap, 
+# returning the merged intervals as an (n, 2) array.
+def _merge_intervals(starts, ends):
+
+    if len(starts) == 0:
+        return np.empty((0, 2), dtype = starts.dtype)
+
+    # Furthest end time of any clip up to and including this one.
+    furthest = np.maximum.accumulate(ends)
+
+    # A clip is only kept separate if it starts after the end of
+    # everything before it; otherwise it gets blobbed together.
+    new_clip = np.empty(len(starts), dtype = bool)
+    new_clip[0] = True
+    new_clip[1:] = starts[1:] > furthest[:-1]
+
+    first = np.flatnonzero(new_clip)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+
+    return np.column_stack([starts[first], furthest[last]])
+
+
+
+# Same as highlight_intervals, but returns the clips as a list of 
+# (start, end) tuples.
+
 # This function assumes a data frame passed in with an index
 # from 0 to len(df) in order; see get_highlights_timestamp 
 # for passing in a dataframe with datetime indices. Moviepy 
@@ -85,80 +164,42 @@ def highlight_by_probability(df, sensitivity = 0.05, roll = 5):
 # for plotting with the rest of the time series data. Pass in 
 # df.reset_index(drop = True) to quickly convert the index.
 def get_highlights_index(df, before_time = 15, after_time = 15, target_col = "highlight"):
-    
-    # Find the indices designated as a highlight
-    timestamps = df[df[target_col] == 1].index
-    
-    all_clips = []
-    i = 0
-    
-    # Iterate over each highlighted index
-    while i < len(timestamps):
-        
-        # Find the start and end times of the clip
-        start = timestamps[i] - before_time
-        end   = timestamps[i] + after_time
-
-        try:
-            
-            # If the start of the next clip occurs before the 
-            # end of the current clip, increase the length of 
-            # the current clip to include the next end time
-            # and ignore the next index.
-            while timestamps[i + 1] - before_time <= end:
-
-                # Update the end time
-                end = timestamps[i + 1] + after_time
-
-                # Cause the next clip to be skipped
-                i += 1
-        
-        # try/except logic exists to ensure that the while 
-        # loop does not go over the index of timestamps. 
-        # This is only an issue for the last clip in timestamp.
-        except IndexError:
-            pass
-        
-        # Append the start and end times as a tuple
-        all_clips.append((start, end))
-
-        # Go to the next clip
-        i += 1
-        
-    return all_clips
+
+    intervals = highlight_intervals(df, before_time, after_time, target_col)
+
+    return [(start, end) for start, end in intervals]
 
 
 
 # This function is the same logic as before but supports pandas 
 # dataframes with datetime indexes and returns timestamps instead.
 def get_highlights_timestamp(df, before_time = 15, after_time = 15, target_col = "highlight"):
-        
-    timestamps = df[df[target_col] == 1].index
-    
-    all_clips = []
-    i = 0
-    
-    while i < len(timestamps):
-        
-        start = timestamps[i] - timedelta(seconds = before_time)
-        end   = timestamps[i] + timedelta(seconds = after_time)
 
-        try:
-            
-            while timestamps[i + 1] - timedelta(seconds = before_time) <= end:
+    intervals = highlight_intervals(df, before_time, after_time, target_col)
+
+    return [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in intervals]
+
+
+
+# Returns the length of every clip in seconds (or in the units of the
+# index for integer clips), for clips from any of the above functions.
+def clip_durations(all_clips):
+
+    if isinstance(all_clips, np.ndarray):
+        starts, ends = pd.Index(all_clips[:, 0]), pd.Index(all_clips[:, 1])
+    else:
+        starts = pd.Index([clip[0] for clip in all_clips])
+        ends = pd.Index([clip[1] for clip in all_clips])
 
-                end = timestamps[i + 1] + timedelta(seconds = after_time)
+    if len(starts) == 0:
+        return np.zeros(0)
 
-                i += 1
-        
-        except IndexError:
-            pass
-        
-        all_clips.append((start, end))
+    lengths = ends - starts
 
-        i += 1
-        
-    return all_clips
+    if isinstance(lengths, pd.TimedeltaIndex):
+        lengths = lengths.total_seconds()
+
+    return lengths.to_numpy()
 
 
 
@@ -166,22 +207,11 @@ def get_highlights_timestamp(df, before_time = 15, after_time = 15, target_col =
 # Will work for ranges generated by either of the above functions.
 def clip_stats(all_clips):
 
-    total = 0
-    
-    for highlight in all_clips:
-        
-        # Clips are in integer format
-        if type(highlight[0]) == np.int64:
-            total += highlight[1] - highlight[0]
-            
-        # Clips are in timestamp format
-        else:
-            total += (highlight[1] - highlight[0]).seconds
-
-    # output = str(int(total / 60)) + ":"
-    # if (total % 60) < 10
-    #     output += "0"
-    # output += str(total % 60)
+    total = clip_durations(all_clips).sum()
+
+    # Whole seconds are printed without a decimal point.
+    if float(total).is_integer():
+        total = int(total)
 
     print(len(all_clips), "distinct clips")
     print(f"{int(total / 60)}:{total % 60} total minutes of video")
@@ -190,6 +220,27 @@ def clip_stats(all_clips):
 
 # Helper function to find the z_score of 
 # the rolling standard deviation.
-def _scale_data(df, roll = 5):
+def _scale_data(df, roll = 5, baseline = None):
     stdev = df["mps"].rolling(roll).std()
-    return stdev - stdev.mean() / stdev.std()
\ No newline at end of file
+
+    if baseline is None:
+        mean, std = stdev.mean(), stdev.std()
+    else:
+        mean, std = _baseline_stats(baseline, roll)
+
+    return (stdev - mean) / std
+
+
+
+# (mean, stdev) of a baseline given as a tuple or as a
+# RollingStdBaseline from baseline_store.py, which has
+# to have been built with the same rolling window size.
+def _baseline_stats(baseline, roll):
+
+    if isinstance(baseline, (tuple, list)):
+        return baseline[0], baseline[1]
+
+    if getattr(baseline, "roll", None) not in (None, roll):
+        raise ValueError(f"the baseline was built with roll = {baseline.roll}, not roll = {roll}")
+
+    return baseline.mean, baseline.std
\ No newline at end of file
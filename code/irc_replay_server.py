@@ -0,0 +1,343 @@
+###
+#
+# Filename: irc_replay_server.py
+# Author: Derek Steffan
+#
+# This file contains a local stand-in for the Twitch IRC server, for
+# testing twitch_chat_scrape.py and twitch_chat_ingest.py without an
+# OAuth token or a live broadcast. See scrape_load_test.py for using it
+# to measure how fast they can keep up.
+#
+# A client connects and sends PASS (optional), NICK and JOIN like it
+# would to irc.chat.twitch.tv, gets the same welcome and JOIN replies,
+# and then every joined channel is sent the PRIVMSGs of a recorded .log
+# file (or of one from synthetic_chat.py), either with the timing they
+# were recorded with, sped up by some factor, or as fast as the client
+# can take them. The server PINGs every client at an interval and
+# counts the PONGs that come back.
+#
+# Real servers do not send one IRC line per packet, so neither does this
+# one: 'coalesce' sends up to that many lines in one write, and with
+# 'fragment' a write is split in two at a random byte, possibly in the
+# middle of a UTF-8 character, and the halves are sent a moment apart.
+#
+# Run it from the code directory with e.g.:
+# python irc_replay_server.py ../data/logs/chat_admiralbulldog_4_30.log --speed 10
+# and point the scraper at it with server = "localhost", port = 6667.
+#
+###
+
+import argparse
+import asyncio
+import time
+import numpy as np
+from chat_log_writer import open_log
+import twitch_chat_format as tcf
+
+
+
+# Description of arguments:
+
+# events
+# List of (seconds, line) tuples, with 'seconds' the time of every raw
+# PRIVMSG line from the start of the broadcast; see load_replay.
+
+# speed
+# How many times faster than recorded to replay the chat, or None to
+# send every line as fast as the client reads them.
+
+# ping_interval
+# Seconds between PINGs. Twitch sends one about every five minutes.
+
+# coalesce
+# Largest number of lines to send in one write.
+
+# fragment
+# Probability that a write is split in two.
+
+# seed
+# Seed for splitting the lines up into writes.
+class ReplayServer:
+
+    def __init__(self, events, speed = 1.0, ping_interval = 300, coalesce = 1,
+                 fragment = 0.0, seed = 0):
+
+        self.events = events
+        self.speed = speed
+        self.ping_interval = ping_interval
+        self.coalesce = max(int(coalesce), 1)
+        self.fragment = fragment
+        self.seed = seed
+
+        self.server = None
+        self.port = None
+
+        # Totals over every connection.
+        self.stats = {"connections": 0, "lines_sent": {}, "bytes_sent": 0, "writes": 0,
+                      "fragmented": 0, "pings": 0, "pongs": 0, "replays_finished": 0}
+
+
+
+    # Starts listening; port = 0 picks a free port, see self.port.
+    async def start(self, host = "localhost", port = 6667):
+
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+        return self
+
+
+
+    async def serve_forever(self):
+
+        async with self.server:
+            await self.server.serve_forever()
+
+
+
+    async def close(self):
+
+        self.server.close()
+        await self.server.wait_closed()
+
+
+
+    async def _handle(self, reader, writer):
+
+        self.stats["connections"] += 1
+
+        # Lines of different channels share the connection, so a write
+        # and the second half of a fragmented one must not be interleaved.
+        lock = asyncio.Lock()
+        tasks = [asyncio.create_task(self._ping(writer, lock))]
+        nick = "justinfan"
+
+        try:
+            while True:
+
+                raw = await reader.readline()
+
+                if not raw:
+                    break
+
+                command, _, argument = raw.decode("utf-8", errors = "replace").strip().partition(" ")
+                command = command.upper()
+
+                if command == "NICK":
+                    nick = argument.strip().lower()
+                    await self._send(writer, lock, _welcome_lines(nick))
+
+                elif command == "JOIN":
+                    for channel in argument.replace("#", "").lower().split(","):
+                        await self._send(writer, lock, _join_lines(nick, channel))
+                        tasks.append(asyncio.create_task(self._replay(writer, lock, channel)))
+
+                elif command == "PONG":
+                    self.stats["pongs"] += 1
+
+                elif command == "PING":
+                    await self._send(writer, lock, [f"PONG {argument}\r\n"])
+
+                # PASS, CAP and anything else is accepted and ignored.
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            writer.close()
+
+
+
+    # Sends every event to one channel of a connection.
+    async def _replay(self, writer, lock, channel):
+
+        rng = np.random.RandomState(self.seed)
+        started = time.monotonic()
+        self.stats["lines_sent"].setdefault(channel, 0)
+
+        try:
+            i = 0
+
+            while i < len(self.events):
+
+                # Everything that is due by now goes out at once.
+                due = self.events[i][0] / self.speed if self.speed else 0.0
+                wait = started + due - time.monotonic()
+
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                now = (time.monotonic() - started) * (self.speed or 0.0)
+                j = i + 1
+
+                while j < len(self.events) and (not self.speed or self.events[j][0] <= now) \
+                      and j - i < 1000:
+                    j += 1
+
+                lines = [_set_channel(line, channel) for _, line in self.events[i:j]]
+                await self._send(writer, lock, lines, rng)
+
+                self.stats["lines_sent"][channel] += j - i
+                i = j
+
+            self.stats["replays_finished"] += 1
+
+        except ConnectionError:
+            pass
+
+
+
+    async def _ping(self, writer, lock):
+
+        try:
+            while True:
+                await asyncio.sleep(self.ping_interval)
+                await self._send(writer, lock, ["PING :tmi.twitch.tv\r\n"])
+                self.stats["pings"] += 1
+
+        except ConnectionError:
+            pass
+
+
+
+    # Writes the lines, grouped and split up into writes as set up above.
+    async def _send(self, writer, lock, lines, rng = None):
+
+        async with lock:
+
+            i = 0
+
+            while i < len(lines):
+
+                size = rng.randint(1, self.coalesce + 1) if rng is not None else len(lines)
+                data = "".join(lines[i:i + size]).encode("utf-8")
+                i += size
+
+                # Counted before a fragmented write is split in two.
+                self.stats["bytes_sent"] += len(data)
+
+                if rng is not None and len(data) > 1 and rng.random_sample() < self.fragment:
+
+                    cut = rng.randint(1, len(data))
+                    writer.write(data[:cut])
+                    await writer.drain()
+
+                    # Long enough for the first half to be read on its own.
+                    await asyncio.sleep(0.001)
+
+                    data = data[cut:]
+                    self.stats["fragmented"] += 1
+                    self.stats["writes"] += 1
+
+                writer.write(data)
+                self.stats["writes"] += 1
+
+            await writer.drain()
+
+
+
+# Reads the PRIVMSG lines out of a .log file written by the scraper (or
+# by synthetic_chat.py) as a list of (seconds, line) tuples, with the
+# time of every line from the first one. Lines without a timestamp of
+# their own get the timestamp of the read they were logged with.
+def load_replay(path):
+
+    events = []
+    first = None
+    seconds = 0.0
+
+    with open_log(path) as log:
+
+        for row in log:
+
+            stamp, marker, rest = row.partition(";;;")
+
+            if marker and tcf._TIMESTAMP_RE.fullmatch(stamp.strip()):
+
+                # Like the parser, a timestamp that is not a real time
+                # is skipped and the line keeps the last one.
+                try:
+                    milliseconds = tcf._epoch_milliseconds(stamp.strip())
+                except ValueError:
+                    milliseconds = None
+
+                if milliseconds is not None:
+                    first = milliseconds if first is None else first
+                    seconds = (milliseconds - first) / 1000
+
+                row = rest.lstrip(" ")
+
+            line = row.rstrip("\r\n")
+
+            if " PRIVMSG #" in line:
+                events.append((seconds, line + "\r\n"))
+
+    return events
+
+
+
+# Points a raw PRIVMSG line at another channel.
+def _set_channel(line, channel):
+
+    prefix, _, rest = line.partition(" PRIVMSG #")
+    _, _, message = rest.partition(" ")
+
+    return f"{prefix} PRIVMSG #{channel} {message}"
+
+
+
+def _welcome_lines(nick):
+
+    return [f":tmi.twitch.tv 001 {nick} :Welcome, GLHF!\r\n",
+            f":tmi.twitch.tv 002 {nick} :Your host is tmi.twitch.tv\r\n",
+            f":tmi.twitch.tv 003 {nick} :This server is rather new\r\n",
+            f":tmi.twitch.tv 004 {nick} :-\r\n",
+            f":tmi.twitch.tv 375 {nick} :-\r\n",
+            f":tmi.twitch.tv 372 {nick} :You are in a maze of twisty passages, all alike.\r\n",
+            f":tmi.twitch.tv 376 {nick} :>\r\n"]
+
+
+
+def _join_lines(nick, channel):
+
+    return [f":{nick}!{nick}@{nick}.tmi.twitch.tv JOIN #{channel}\r\n",
+            f":{nick}.tmi.twitch.tv 353 {nick} = #{channel} :{nick}\r\n",
+            f":{nick}.tmi.twitch.tv 366 {nick} #{channel} :End of /NAMES list\r\n"]
+
+
+
+async def _main(args):
+
+    server = ReplayServer(load_replay(args.log), args.speed or None, args.ping_interval,
+                          args.coalesce, args.fragment, args.seed)
+    await server.start(args.host, args.port)
+
+    print(f"Replaying {len(server.events)} messages on {args.host}:{server.port}")
+
+    await server.serve_forever()
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Replay a Twitch chat log as a local IRC server.")
+    parser.add_argument("log", help = ".log file to replay")
+    parser.add_argument("--host", default = "localhost")
+    parser.add_argument("--port", type = int, default = 6667)
+    parser.add_argument("--speed", type = float, default = 1.0,
+                        help = "times faster than recorded, or 0 for as fast as possible")
+    parser.add_argument("--ping-interval", type = float, default = 300)
+    parser.add_argument("--coalesce", type = int, default = 1, help = "most lines in one write")
+    parser.add_argument("--fragment", type = float, default = 0.0,
+                        help = "probability of splitting a write in two")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_main(args))
+
+    except KeyboardInterrupt:
+        pass
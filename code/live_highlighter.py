@@ -0,0 +1,264 @@
+###
+#
+# Filename: live_highlighter.py
+# Author: Derek Steffan
+#
+# This file contains an incremental version of the highlighters in
+# highlighter.py that can be fed messages per second data one sample
+# at a time, e.g. while a broadcast is still live, and reports the
+# start and end of every highlight as soon as it is known.
+#
+# highlight_by_stdev and highlight_by_probability scale the rolling
+# standard deviation with the mean and stdev of the whole series, which
+# only exist once the broadcast is over. Here those are replaced by a
+# running mean and variance (Welford's algorithm), so every update is
+# O(1) and memory does not grow with the length of the broadcast. If
+# the mean and stdev are already known, e.g. from an earlier broadcast
+# of the same channel, they can be passed in as the 'baseline' instead,
+# in which case every second is scored as a z-score against it and the
+# flags match the batch functions given the same baseline exactly.
+#
+###
+
+import math
+from collections import deque
+import metrics
+
+
+
+class LiveHighlighter:
+
+    # method
+    # Either "stdev" to flag seconds like highlight_by_stdev, or
+    # "probability" to flag them like highlight_by_probability.
+
+    # threshold, sensitivity, roll
+    # Same as the arguments of the batch functions in highlighter.py.
+
+    # baseline
+    # Optional (mean, stdev) of the rolling standard deviation to score
+    # against, or a baseline from baseline_store.py built with the same
+    # 'roll'. If left as None, the running mean and stdev of every
+    # rolling standard deviation seen so far are used instead.
+
+    # warmup
+    # Number of rolling standard deviations that have to be seen before
+    # anything is flagged when no baseline is given, since the running
+    # mean and stdev are very noisy for the first few samples.
+    def __init__(self, method = "stdev", threshold = 4, sensitivity = 0.05,
+                 roll = 5, baseline = None, warmup = 60):
+
+        if method not in ("stdev", "probability"):
+            raise ValueError("method must be either 'stdev' or 'probability'")
+
+        if baseline is not None and not isinstance(baseline, (tuple, list)):
+
+            if getattr(baseline, "roll", None) not in (None, roll):
+                raise ValueError(f"the baseline was built with roll = {baseline.roll}, not roll = {roll}")
+
+            baseline = (baseline.mean, baseline.std)
+
+        self.method = method
+        self.threshold = threshold
+        self.sensitivity = sensitivity
+        self.roll = roll
+        self.baseline = baseline
+        self.warmup = warmup
+
+        # Rolling window of the last 'roll' samples along with its
+        # running mean and sum of squared differences.
+        self._window = deque(maxlen = roll)
+        self._window_mean = 0.0
+        self._window_m2 = 0.0
+
+        # Welford's running mean and variance of the rolling stdev.
+        self.n_stdev = 0
+        self._stdev_mean = 0.0
+        self._stdev_m2 = 0.0
+
+        # Markov state; the last scaled score, or None before the first one.
+        self._last_score = None
+
+        # State of the current highlight.
+        self.n_samples = 0
+        self.in_highlight = False
+        self._last_time = None
+
+        # The most recent values, handy for plotting as the data comes in.
+        self.stdev = math.nan
+        self.z_score = math.nan
+        self.probability = math.nan
+
+
+
+    # Running mean and stdev of the rolling standard deviation,
+    # or the baseline if one was given.
+    @property
+    def mean(self):
+
+        if self.baseline is not None:
+            return self.baseline[0]
+
+        return self._stdev_mean if self.n_stdev > 0 else math.nan
+
+
+
+    @property
+    def std(self):
+
+        if self.baseline is not None:
+            return self.baseline[1]
+
+        if self.n_stdev < 2:
+            return math.nan
+
+        return math.sqrt(self._stdev_m2 / (self.n_stdev - 1))
+
+
+
+    # Takes in the number of messages for one second (or whatever the
+    # bin width of the series is) and returns a list of the highlight
+    # events it caused, as ("start", time) or ("end", time) tuples.
+    # The end time is the time of the last flagged sample. If 'time'
+    # is not given, the number of samples seen so far is used instead.
+    def update(self, mps, time = None):
+
+        with metrics.timer("highlight.live_update"):
+            return self._update(mps, time)
+
+
+
+    def _update(self, mps, time):
+
+        if time is None:
+            time = self.n_samples
+
+        self.n_samples += 1
+        self.stdev = self._update_window(float(mps))
+
+        if not math.isnan(self.stdev):
+            self._update_stdev_stats(self.stdev)
+
+        # Same scaling as highlighter._scale_data, which is 
+        # undefined until there are at least two stdevs.
+        if not self.std > 0:
+            self.z_score = math.nan
+        else:
+            self.z_score = (self.stdev - self.mean) / self.std
+
+        flagged = self._flag(self.z_score)
+
+        events = []
+
+        if flagged and not self.in_highlight:
+            events.append(("start", time))
+
+        elif not flagged and self.in_highlight:
+            events.append(("end", self._last_time))
+
+        self.in_highlight = flagged
+        self._last_time = time
+
+        return events
+
+
+
+    # Feeds every value of an iterable (or pandas series, in which case
+    # the index is used for the times) through update, returning all of
+    # the events in order.
+    def update_many(self, values, times = None):
+
+        if times is None and hasattr(values, "index"):
+            times = values.index
+
+        if times is None:
+            times = [None] * len(values)
+
+        events = []
+
+        for mps, time in zip(values, times):
+            events.extend(self.update(mps, time))
+
+        return events
+
+
+
+    # Ends the current highlight, if any; call this once the broadcast is over.
+    def close(self):
+
+        if self.in_highlight:
+            self.in_highlight = False
+            return [("end", self._last_time)]
+
+        return []
+
+
+
+    # Adds one sample to the rolling window, removing the oldest sample
+    # once the window is full, and returns the sample standard deviation
+    # of the window (NaN until the window is full, like pandas' rolling).
+    def _update_window(self, x):
+
+        if len(self._window) == self.roll:
+            y = self._window[0]
+            n = len(self._window) - 1
+
+            if n == 0:
+                self._window_mean = 0.0
+                self._window_m2 = 0.0
+
+            else:
+                delta = y - self._window_mean
+                self._window_mean -= delta / n
+                self._window_m2 -= delta * (y - self._window_mean)
+
+        self._window.append(x)
+
+        n = len(self._window)
+        delta = x - self._window_mean
+        self._window_mean += delta / n
+        self._window_m2 += delta * (x - self._window_mean)
+
+        if n < self.roll or n < 2:
+            return math.nan
+
+        return math.sqrt(max(self._window_m2, 0.0) / (n - 1))
+
+
+
+    # Welford's update of the running mean and variance.
+    def _update_stdev_stats(self, stdev):
+
+        self.n_stdev += 1
+        delta = stdev - self._stdev_mean
+        self._stdev_mean += delta / self.n_stdev
+        self._stdev_m2 += delta * (stdev - self._stdev_mean)
+
+
+
+    def _flag(self, score):
+
+        warm = self.baseline is not None or self.n_stdev >= self.warmup
+
+        if self.method == "stdev":
+            self.probability = math.nan
+            flagged = score >= self.threshold
+
+        else:
+            # Normal pdf centered on the last score, see
+            # highlighter._markov_probability. The very first sample
+            # is centered on the mean of the scores instead, which for
+            # z-scores is 0 (with a stdev of 1). While the running stdev
+            # is still 0 the score, and so the probability, is NaN.
+            mu = 0.0 if self._last_score is None else self._last_score
+
+            scaled = score - mu
+            self.probability = math.exp(-scaled * scaled / 2.0) / math.sqrt(2 * math.pi)
+
+            self._last_score = score
+
+            flagged = self.probability <= self.sensitivity
+
+        # Comparisons with NaN are always False, so
+        # nothing is flagged until the scores exist.
+        return bool(flagged) and warm
@@ -0,0 +1,186 @@
+###
+#
+# Filename: log_index.py
+# Author: Derek Steffan
+#
+# This file contains a sparse time index for the raw .log files written
+# by twitch_chat_scrape.py, used by twitch_chat_format.py to parse only
+# the part of a log between two times (e.g. a single game of a stream)
+# instead of parsing the whole log and slicing it afterwards.
+#
+# The index holds the byte offset of the first line logged in every
+# 'every' seconds of the log, found in one pass over the file, and is
+# saved next to it, e.g. chat_admiralbulldog_4_30.log.index.npz. It is
+# rebuilt whenever the log changes. A time range is then turned into
+# the byte range between the index entries on either side of it, which
+# is read from the memory-mapped log.
+#
+# This assumes the timestamps in the log never go backwards, which is
+# the case for every log written by twitch_chat_scrape.py.
+#
+###
+
+import mmap
+import os
+import re
+import numpy as np
+import pandas as pd
+
+
+
+# Same timestamp as twitch_chat_format.py looks for, as bytes.
+_TIMESTAMP_RE = re.compile(rb"[0-9]{4}-[0-9]{2}-[0-9]{2}_[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]{3})?")
+
+
+
+# Path the index of the log at 'path' is saved to.
+def index_path(path):
+    return f"{path}.index.npz"
+
+
+
+# Reads the index of a log, building (and saving) it first if there is
+# none yet or if the log has changed since. Returns a dictionary with
+# the "times" (seconds since the epoch) and byte "offsets" of the lines
+# in the index, plus the "size" of the log when it was indexed.
+def load_log_index(path, every = 60):
+
+    stat = os.stat(path)
+    saved = index_path(path)
+
+    if os.path.exists(saved):
+
+        with np.load(saved) as index:
+            index = {key: index[key] for key in index.files}
+
+        if (index["size"] == stat.st_size and index["mtime"] == stat.st_mtime_ns
+                and index["every"] == every):
+            return index
+
+    return build_log_index(path, every)
+
+
+
+# Builds the index of a log in one pass and saves it next to the log.
+def build_log_index(path, every = 60):
+
+    times = []
+    offsets = []
+
+    stat = os.stat(path)
+
+    with open(path, "rb") as log:
+
+        # mmap cannot map an empty file.
+        if stat.st_size:
+
+            with mmap.mmap(log.fileno(), 0, access = mmap.ACCESS_READ) as data:
+
+                offset = 0
+                next_time = None
+                last_stamp = None
+
+                for line in iter(data.readline, b""):
+
+                    # Only the lines with a timestamp (i.e. not the backed up
+                    # lines continuing a "jam") can start a range; see
+                    # _parse_lines in twitch_chat_format.py.
+                    stamp, marker, _ = line.partition(b";;;")
+                    stamp = stamp.strip()
+
+                    # Most lines share their timestamp with the line before.
+                    if marker and stamp != last_stamp and _TIMESTAMP_RE.fullmatch(stamp):
+
+                        # The parser reads a timestamp that is not a real
+                        # time (e.g. the 30th of February) as no timestamp.
+                        try:
+                            time = _epoch_seconds(stamp)
+                        except ValueError:
+                            time = None
+
+                        last_stamp = stamp
+
+                        if time is not None and (next_time is None or time >= next_time):
+                            times.append(time)
+                            offsets.append(offset)
+                            next_time = time + every
+
+                    offset += len(line)
+
+    index = {"times": np.array(times, dtype = np.int64),
+             "offsets": np.array(offsets, dtype = np.int64),
+             "size": np.int64(stat.st_size),
+             "mtime": np.int64(stat.st_mtime_ns),
+             "every": np.int64(every)}
+
+    # Written to a temporary file first, like the cache in chat_cache.py,
+    # so that another process never reads half an index.
+    temp_path = f"{index_path(path)}.{os.getpid()}.tmp.npz"
+    np.savez(temp_path, **index)
+    os.replace(temp_path, index_path(path))
+
+    return index
+
+
+
+# Returns the (start, end) byte offsets of a part of the log holding
+# every message logged between 'start' and 'end' (either can be None).
+# The range starts and ends on a line with a timestamp, and can hold a
+# few seconds of messages on either side, so the messages parsed from
+# it still have to be sliced by time.
+
+# 'start' and 'end' can be anything pandas can slice a DatetimeIndex by,
+# e.g. "2019-04-30 10:29:26"; a partial time like "2019-04-30 11:14" as
+# 'end' takes in the whole minute, just like slicing with .loc does.
+def time_range_offsets(path, start = None, end = None, every = 60):
+
+    index = load_log_index(path, every)
+    times, offsets = index["times"], index["offsets"]
+
+    first = 0
+    last = int(index["size"])
+
+    if start is not None:
+        i = np.searchsorted(times, _bound(start, "start"), side = "right") - 1
+        first = int(offsets[i]) if i >= 0 else 0
+
+    if end is not None:
+        i = np.searchsorted(times, _bound(end, "end"), side = "right")
+        last = int(offsets[i]) if i < len(offsets) else last
+
+    return first, max(first, last)
+
+
+
+# Reads the bytes between two offsets of a log from a memory map of it,
+# which only pages in the part of the file that is needed.
+def read_range(path, start, end):
+
+    if end <= start:
+        return b""
+
+    with open(path, "rb") as log:
+        with mmap.mmap(log.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            return data[start:end]
+
+
+
+# Seconds since the epoch of the earliest (or latest) time covered by
+# a bound given as a string or a datetime.
+def _bound(value, side):
+
+    if isinstance(value, str):
+        period = pd.Period(value)
+        time = period.start_time if side == "start" else period.end_time
+    else:
+        time = pd.Timestamp(value)
+
+    return time.floor("s").value // 1_000_000_000
+
+
+
+# b"2019-04-30_18:31:07" (with or without milliseconds) 
+# -> whole seconds since the epoch, as an int.
+def _epoch_seconds(stamp):
+
+    return int(np.datetime64(stamp.decode("ascii").replace("_", "T"), "ms").astype(np.int64)) // 1000
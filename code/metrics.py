@@ -0,0 +1,346 @@
+###
+#
+# Filename: metrics.py
+# Author: Derek Steffan
+#
+# This file contains the timers and counters shared by the scraper
+# (twitch_chat_scrape.py and chat_log_writer.py), the parser
+# (twitch_chat_format.py) and the highlighters (highlighter.py and
+# live_highlighter.py), for seeing where the time goes and how far the
+# scraper falls behind the socket.
+#
+# Everything is off by default, in which case every call returns right
+# away and the cost is one function call. The hot loops (e.g. parsing
+# every line of a log) add up their counts locally and only report them
+# once per chunk. Metrics are turned on with enable(), or by setting the
+# environment variable
+#
+# TWITCH_CHAT_METRICS=metrics.jsonl
+#
+# which also appends a final snapshot to that file when Python exits.
+# Snapshots can be written as JSON lines with write_jsonl or as the
+# Prometheus text format with prometheus_text.
+#
+# Separately, any stage can be run under cProfile or tracemalloc by
+# naming it (or its prefix, e.g. "format" for "format.parse") in
+#
+# TWITCH_CHAT_PROFILE=format,highlight       one .prof file per stage
+# TWITCH_CHAT_TRACEMALLOC=format             peak memory of the stage
+#
+# Every run of a profiled stage is added to one profile for the stage,
+# so stages that run very often (e.g. LiveHighlighter.update, once per
+# second of chat) still give one file. The profiles are saved when
+# Python exits, or whenever write_profiles() is called, to
+# TWITCH_CHAT_PROFILE_DIR ("profiles" by default) and can be read with
+# pstats or snakeviz. tracemalloc is started once and left running, and
+# the peak is the most memory any one run of the stage added. The peaks
+# are kept whether or not metrics are on, and saved along with the
+# profiles as tracemalloc.<process id>.json (they are also gauges,
+# <stage>.peak_bytes, in the snapshots while metrics are on).
+#
+# Only one stage is profiled at a time, so a profiled stage that starts
+# while another one is running (nested in it, or in another thread such
+# as the writer thread of chat_log_writer.py) is left out of the profile
+# with a warning the first time it happens.
+#
+###
+
+import atexit
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+import warnings
+from contextlib import contextmanager
+
+
+
+ENABLED = False
+
+_counters = {}
+_gauges = {}
+_timers = {}
+_lock = threading.Lock()
+
+_PROFILE_STAGES = set(filter(None, os.environ.get("TWITCH_CHAT_PROFILE", "").split(",")))
+_TRACEMALLOC_STAGES = set(filter(None, os.environ.get("TWITCH_CHAT_TRACEMALLOC", "").split(",")))
+_PROFILE_DIR = os.environ.get("TWITCH_CHAT_PROFILE_DIR", "profiles")
+
+# Stage name to its cumulative cProfile.Profile.
+_profilers = {}
+_profiling = False
+
+# Stage name to the peak memory of its tracemalloc runs, in bytes.
+_peaks = {}
+
+# Stages that were left out of a profile, to only warn once for each.
+_skipped = set()
+_writing = False
+
+
+
+# Turns metrics on. If 'path' is given, a snapshot is appended
+# to it as a JSON line when Python exits.
+def enable(path = None):
+
+    global ENABLED
+    ENABLED = True
+
+    if path is not None:
+        atexit.register(write_jsonl, path)
+
+
+
+def disable():
+
+    global ENABLED
+    ENABLED = False
+
+
+
+# Clears every counter, gauge and timer.
+def reset():
+
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timers.clear()
+
+
+
+# Adds 'value' to a counter, e.g. count("format.messages", len(chunk)).
+def count(name, value = 1):
+
+    if not ENABLED:
+        return
+
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+
+# Sets a gauge to its current value, e.g. the depth of a queue.
+def gauge(name, value):
+
+    if not ENABLED:
+        return
+
+    _gauges[name] = value
+
+
+
+# Adds one measurement of 'seconds' to a timer, for timing code
+# that does not fit in a with statement (e.g. a generator).
+def record(name, seconds):
+
+    if not ENABLED:
+        return
+
+    with _lock:
+        timer = _timers.get(name)
+
+        if timer is None:
+            timer = _timers[name] = {"count": 0, "total": 0.0, "max": 0.0}
+
+        timer["count"] += 1
+        timer["total"] += seconds
+        timer["max"] = max(timer["max"], seconds)
+
+
+
+# Times the code in a with statement:
+#
+# with metrics.timer("highlight.stdev"):
+#     ...
+#
+# and runs it under cProfile and/or tracemalloc if the
+# stage is named in the environment variables above.
+def timer(name):
+
+    if not ENABLED and not _PROFILE_STAGES and not _TRACEMALLOC_STAGES:
+        return _NO_TIMER
+
+    return _timer(name)
+
+
+
+@contextmanager
+def _timer(name):
+
+    global _profiling
+
+    stage = name.split(".")[0]
+
+    # Only one profiler can run at a time, so nested stages are
+    # left out of the profile of the stage around them.
+    profiler = None
+
+    if name in _PROFILE_STAGES or stage in _PROFILE_STAGES:
+
+        with _lock:
+            skip = _profiling
+            _profiling = True
+
+        if not skip:
+            profiler = _profiler(name)
+
+        elif name not in _skipped:
+            _skipped.add(name)
+            warnings.warn(f"'{name}' started while another stage was being profiled "
+                          f"and is left out of the profiles", RuntimeWarning)
+
+    trace = name in _TRACEMALLOC_STAGES or stage in _TRACEMALLOC_STAGES
+
+    if trace:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profiling = False
+
+        record(name, time.perf_counter() - start)
+
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1] - traced_before
+
+            with _lock:
+                _register_write()
+                _peaks[name] = max(_peaks.get(name, 0), peak)
+
+            gauge(f"{name}.peak_bytes", _peaks[name])
+
+
+
+# The profile of a stage, created the first time the stage runs.
+def _profiler(name):
+
+    with _lock:
+        if name not in _profilers:
+            _register_write()
+            _profilers[name] = cProfile.Profile()
+
+        return _profilers[name]
+
+
+
+# Saves the profiles and peaks when Python exits; called with _lock held.
+def _register_write():
+
+    global _writing
+
+    if not _writing:
+        atexit.register(write_profiles)
+        _writing = True
+
+
+
+# Saves the profile of every stage so far to TWITCH_CHAT_PROFILE_DIR,
+# as <stage>.<process id>.prof, and the tracemalloc peaks of every
+# stage as tracemalloc.<process id>.json, replacing the last save.
+def write_profiles():
+
+    with _lock:
+        profilers = dict(_profilers)
+        peaks = dict(_peaks)
+
+    if profilers or peaks:
+        os.makedirs(_PROFILE_DIR, exist_ok = True)
+
+    for name, profiler in profilers.items():
+        profiler.dump_stats(os.path.join(_PROFILE_DIR, f"{name}.{os.getpid()}.prof"))
+
+    if peaks:
+        with open(os.path.join(_PROFILE_DIR, f"tracemalloc.{os.getpid()}.json"), "w",
+                  encoding = "utf-8") as output:
+            json.dump({f"{name}.peak_bytes": peak for name, peak in sorted(peaks.items())},
+                      output, indent = 2)
+
+
+
+# Shared by every timer while everything is off.
+class _NoTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+
+_NO_TIMER = _NoTimer()
+
+
+
+# Every metric as a dictionary.
+def snapshot():
+
+    with _lock:
+        return {"time": time.time(),
+                "counters": dict(_counters),
+                "gauges": dict(_gauges),
+                "timers": {name: dict(timer) for name, timer in _timers.items()}}
+
+
+
+# Appends a snapshot to a JSON lines file.
+def write_jsonl(path):
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+
+    with open(path, "a", encoding = "utf-8") as output:
+        output.write(json.dumps(snapshot()) + "\n")
+
+
+
+# A snapshot in the Prometheus text format, e.g.
+#
+# # TYPE twitch_chat_format_messages_total counter
+# twitch_chat_format_messages_total 28844
+def prometheus_text(prefix = "twitch_chat"):
+
+    data = snapshot()
+    lines = []
+
+    for name, value in sorted(data["counters"].items()):
+        metric = _metric_name(prefix, name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+
+    for name, value in sorted(data["gauges"].items()):
+        metric = _metric_name(prefix, name)
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+
+    for name, timer in sorted(data["timers"].items()):
+        metric = _metric_name(prefix, name) + "_seconds"
+        lines += [f"# TYPE {metric} summary",
+                  f"{metric}_count {timer['count']}",
+                  f"{metric}_sum {timer['total']}"]
+
+    return "\n".join(lines) + "\n"
+
+
+
+# "format.regex_misses" -> "twitch_chat_format_regex_misses"
+def _metric_name(prefix, name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{name}")
+
+
+
+if os.environ.get("TWITCH_CHAT_METRICS"):
+    enable(os.environ["TWITCH_CHAT_METRICS"])
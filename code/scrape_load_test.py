@@ -0,0 +1,238 @@
+###
+#
+# Filename: scrape_load_test.py
+# Author: Derek Steffan
+#
+# This script measures how much chat twitch_chat_scrape.py (or
+# twitch_chat_ingest.py) can keep up with, by pointing it at the local
+# server from irc_replay_server.py instead of Twitch.
+#
+# The server runs in a process of its own and replays a .log file, or
+# a synthetic one, to every channel the clients join. The clients run
+# in this process, one scraper thread per channel or one ingester for
+# every channel, and write their logs with millisecond timestamps to a
+# temporary directory. Once they are done, the logs are parsed with
+# twitch_chat_format and compared with what the server sent, giving:
+#
+# messages_per_second   messages logged over the time it took to receive them
+# cpu_us_per_message    CPU time of this process per message logged, in
+#                       microseconds (the server's CPU time is not included)
+# intact                messages logged exactly as they were sent
+# split                 messages logged with only part of their text, e.g.
+#                       because the line was split across two reads
+# not_logged            messages sent by the server that were not logged intact
+# pongs / pings         PINGs answered; a PING that arrives in the same read
+#                       as a chat message is not answered by the scraper
+#
+# Replaying as fast as possible (speed = 0) with more and more channels
+# shows how many channels one process can take before it falls behind.
+#
+# Run it from the code directory with e.g.:
+# python scrape_load_test.py --synthetic-minutes 10 --speed 0 --channels 1 4 16
+# python scrape_load_test.py --log ../data/logs/chat_admiralbulldog_4_30.log --speed 20 --fragment 0.1
+#
+###
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+import pandas as pd
+from irc_replay_server import ReplayServer, load_replay
+import synthetic_chat
+import twitch_chat_format as tcf
+from twitch_chat_ingest import twitch_chat_ingest
+from twitch_chat_scrape import twitch_chat_scrape
+
+
+
+# Description of arguments:
+
+# events
+# List of (seconds, line) tuples to replay; see irc_replay_server.load_replay
+# and synthetic_events.
+
+# channels
+# Number of channels to join, every one of which gets all of the events.
+
+# client
+# Either "scrape" to run one twitch_chat_scrape per channel in threads,
+# or "ingest" to run twitch_chat_ingest over every channel.
+
+# seconds
+# How long to run the clients for. By default, long enough for the whole
+# replay at 'speed' plus a few seconds, or 30 seconds with speed = 0.
+
+# speed, coalesce, fragment, ping_interval, seed
+# Passed along to the ReplayServer. The PINGs also wake up scrapers that
+# are waiting on a quiet socket, so that they stop on time.
+
+# Returns a dictionary of the results described at the top of this file.
+def run_load_test(events, channels = 1, client = "scrape", seconds = None, speed = 0,
+                  coalesce = 1, fragment = 0.0, ping_interval = 1.0, seed = 0):
+
+    if client not in ("scrape", "ingest"):
+        raise ValueError("client must be either 'scrape' or 'ingest'")
+
+    if seconds is None:
+        seconds = events[-1][0] / speed + 5 if speed else 30
+
+    names = [f"load_test_{i}" for i in range(channels)]
+    options = {"speed": speed or None, "ping_interval": ping_interval,
+               "coalesce": coalesce, "fragment": fragment, "seed": seed}
+
+    queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    server = multiprocessing.Process(target = _serve, args = (events, options, queue, stop))
+    server.start()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+
+        try:
+            port = queue.get(timeout = 60)
+
+            started = time.process_time()
+            _run_clients(client, names, seconds, log_dir, port)
+            cpu_seconds = time.process_time() - started
+
+        finally:
+            stop.set()
+
+        stats = queue.get(timeout = 60)
+        server.join()
+
+        logged = [tcf.twitch_chat_format(os.path.join(log_dir, f"chat_{name}.log")) for name in names]
+
+    expected = Counter(_username_message(line) for _, line in events)
+
+    n_logged = sum(len(df) for df in logged)
+    intact = sum(sum((Counter(zip(df["username"], df["message"])) & expected).values())
+                 for df in logged)
+    sent = sum(stats["lines_sent"].values())
+
+    # From the first message received to the last one, over every channel.
+    times = pd.concat([df.index.to_series() for df in logged]) if n_logged else pd.Series()
+    span = (times.max() - times.min()).total_seconds() if n_logged else 0.0
+
+    return {"client": client,
+            "channels": channels,
+            "speed": speed,
+            "coalesce": coalesce,
+            "fragment": fragment,
+            "sent": sent,
+            "logged": n_logged,
+            "intact": intact,
+            "split": n_logged - intact,
+            "not_logged": sent - intact,
+            "messages_per_second": n_logged / max(span, 1e-3),
+            "cpu_us_per_message": cpu_seconds / max(n_logged, 1) * 1e6,
+            "pings": stats["pings"],
+            "pongs": stats["pongs"],
+            "replays_finished": stats["replays_finished"],
+            "seconds": seconds}
+
+
+
+# Events of a log from synthetic_chat.py; any keyword arguments are
+# passed along to generate_chat_log.
+def synthetic_events(minutes = 10, **kwargs):
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        path = os.path.join(temp_dir, "synthetic.log")
+        synthetic_chat.generate_chat_log(path, minutes = minutes, **kwargs)
+
+        return load_replay(path)
+
+
+
+def _run_clients(client, names, seconds, log_dir, port):
+
+    nickname, token = "justinfan12345", "oauth:load_test"
+
+    # The scrapers print their checkpoints, which are not needed here.
+    with contextlib.redirect_stdout(io.StringIO()):
+
+        if client == "ingest":
+            twitch_chat_ingest(nickname, token, names, seconds / 60, log_dir = log_dir,
+                               server = "localhost", port = port, milliseconds = True)
+            return
+
+        threads = [threading.Thread(target = twitch_chat_scrape,
+                                    args = (nickname, token, name, seconds / 60),
+                                    kwargs = {"path": os.path.join(log_dir, f"chat_{name}.log"),
+                                              "milliseconds": True,
+                                              "server": "localhost", "port": port})
+                   for name in names]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+
+
+# Runs the server in its own process until 'stop' is set, putting its
+# port and then its stats on the queue.
+def _serve(events, options, queue, stop):
+    asyncio.run(_serve_until_stopped(events, options, queue, stop))
+
+
+
+async def _serve_until_stopped(events, options, queue, stop):
+
+    server = await ReplayServer(events, **options).start("localhost", 0)
+    queue.put(server.port)
+
+    await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+
+    queue.put(server.stats)
+    await server.close()
+
+
+
+# The (username, message) of a raw PRIVMSG line, the same way
+# twitch_chat_format finds them.
+def _username_message(line):
+
+    username, _, message = tcf._PRIVMSG_RE.search(line.strip()).groups()
+
+    return username, message
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Load test the Twitch chat scraper against a local server.")
+    parser.add_argument("--log", help = ".log file to replay; a synthetic one is used if not given")
+    parser.add_argument("--synthetic-minutes", type = float, default = 10)
+    parser.add_argument("--client", choices = ["scrape", "ingest"], default = "scrape")
+    parser.add_argument("--channels", type = int, nargs = "+", default = [1],
+                        help = "numbers of channels to test with, one run each")
+    parser.add_argument("--seconds", type = float, default = None, help = "how long to run the clients for")
+    parser.add_argument("--speed", type = float, default = 0,
+                        help = "times faster than recorded, or 0 for as fast as possible")
+    parser.add_argument("--coalesce", type = int, default = 1)
+    parser.add_argument("--fragment", type = float, default = 0.0)
+    parser.add_argument("--output", help = "save the results as JSON")
+    args = parser.parse_args()
+
+    events = load_replay(args.log) if args.log else synthetic_events(args.synthetic_minutes)
+
+    results = [run_load_test(events, channels, args.client, args.seconds, args.speed,
+                             args.coalesce, args.fragment) for channels in args.channels]
+
+    print(pd.DataFrame(results).drop(columns = ["client", "speed", "coalesce", "fragment"])
+          .round(1).to_string(index = False))
+
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as output:
+            json.dump(results, output, indent = 2)
@@ -0,0 +1,180 @@
+###
+#
+# Filename: synthetic_chat.py
+# Author: Derek Steffan
+#
+# This script generates fake Twitch chat .log files in exactly the same
+# format as twitch_chat_scrape.py writes them, for benchmarking and for
+# trying out the rest of the pipeline without scraping a real broadcast.
+#
+# A generated log has the welcome and JOIN messages from connecting to
+# the IRC server, a steady background of chat messages, short bursts of
+# "hype" where the chat rate jumps up and fills with emotes, messages
+# from a chat bot along with the commands sent to it, and "backed up"
+# reads where several messages share one timestamp. The same seed always
+# gives the same log.
+#
+###
+
+import numpy as np
+import pandas as pd
+
+
+
+# A handful of emotes and words to build messages out of.
+EMOTES = ["LUL", "PogChamp", "Kappa", "WutFace", "OMEGALUL", "Kreygasm",
+          "TriHard", "monkaS", "4Head", "BibleThump", "gachiHYPER", "EZ"]
+
+WORDS = ["the", "what", "is", "he", "doing", "nice", "play", "game", "gg",
+         "lol", "no", "way", "this", "guy", "chat", "why", "so", "bad", "good"]
+
+COMMANDS = ["!uptime", "!song", "!rank", "!followage", "!discord"]
+
+
+
+# Description of arguments:
+
+# path
+# Where to write the .log file.
+
+# minutes
+# Length of the fake broadcast.
+
+# rate, hype_rate
+# Average number of messages per second normally and during hype.
+
+# hypes_per_hour, hype_seconds
+# How many bursts of hype there are per hour and how long each lasts.
+
+# backed_up
+# Probability that a read from the socket holds more than one message.
+
+# bot_name, bot_rate
+# Name of the chat bot, and the fraction of messages that are either
+# sent by it or are commands sent to it.
+
+# milliseconds
+# Write timestamps with milliseconds, like ChatLogWriter(milliseconds = True),
+# with the reads of every second spread out at random within it.
+
+# Returns a dictionary with the number of messages written and
+# the (start, end) timestamps of every burst of hype.
+def generate_chat_log(path, minutes = 60, rate = 5.0, hype_rate = 40.0,
+                      hypes_per_hour = 6, hype_seconds = 20, backed_up = 0.1,
+                      channel = "synthetic", n_users = 5000, bot_name = "syntheticbot",
+                      bot_rate = 0.02, start = "2019-04-30 09:00:00", seed = 0,
+                      milliseconds = False):
+
+    rng = np.random.RandomState(seed)
+
+    start = pd.Timestamp(start)
+    seconds = int(minutes * 60)
+
+    # Pick when every burst of hype starts, and find the rate for every second.
+    n_hypes = int(round(hypes_per_hour * minutes / 60))
+    hype_starts = np.sort(rng.choice(max(seconds - hype_seconds, 1), size = n_hypes, replace = False))
+
+    rates = np.full(seconds, rate)
+    hype = np.zeros(seconds, dtype = bool)
+
+    for hype_start in hype_starts:
+        rates[hype_start:hype_start + hype_seconds] = hype_rate
+        hype[hype_start:hype_start + hype_seconds] = True
+
+    counts = rng.poisson(rates)
+    users = [f"user_{i}" for i in range(n_users)]
+
+    n_messages = 0
+
+    # newline = "" so that the "\r\n" at the end of every IRC line is
+    # written as is, just like the logs written by the scraper.
+    with open(path, "w", encoding = "utf-8", newline = "") as log:
+
+        stamp = start.strftime("%Y-%m-%d_%H:%M:%S")
+
+        log.write(f"{stamp} ;;; START OF RECORDED CHAT MESSAGES FROM CHANNEL: {channel.upper()}\n\n")
+        log.write(f"{stamp} ;;; " + "".join(_welcome_lines(channel)) + "\n")
+        log.write(f"{stamp} ;;; :{_NICK}!{_NICK}@{_NICK}.tmi.twitch.tv JOIN #{channel}\r\n"
+                  f":{_NICK}.tmi.twitch.tv 353 {_NICK} = #{channel} :{_NICK}\r\n"
+                  f":{_NICK}.tmi.twitch.tv 366 {_NICK} #{channel} :End of /NAMES list\r\n\n")
+
+        for second in range(seconds):
+
+            if counts[second] == 0:
+                continue
+
+            stamp = (start + pd.Timedelta(seconds = second)).strftime("%Y-%m-%d_%H:%M:%S")
+            lines = [_privmsg(rng, users, channel, hype[second], bot_name, bot_rate)
+                     for _ in range(counts[second])]
+
+            # Split the messages of this second up into reads from the
+            # socket, most of which hold one message but some of which
+            # are "backed up" and hold a few.
+            reads = []
+            i = 0
+
+            while i < len(lines):
+                size = rng.geometric(0.5) + 1 if rng.random_sample() < backed_up else 1
+                reads.append("".join(lines[i:i + size]))
+                i += size
+
+            stamps = [stamp] * len(reads)
+
+            if milliseconds:
+                stamps = [f"{stamp}.{ms:03d}" for ms in np.sort(rng.randint(0, 1000, len(reads)))]
+
+            for read_stamp, read in zip(stamps, reads):
+                log.write(f"{read_stamp} ;;; {read}\n")
+
+            n_messages += len(lines)
+
+        log.write(f"{stamp} ;;; END OF RECORDED CHAT MESSAGES FROM CHANNEL: {channel.upper()}\n\n")
+
+    hypes = [(start + pd.Timedelta(seconds = int(s)),
+              start + pd.Timedelta(seconds = int(s) + hype_seconds)) for s in hype_starts]
+
+    return {"n_messages": n_messages, "hypes": hypes}
+
+
+
+_NICK = "synthetic_scraper"
+
+
+
+def _welcome_lines(channel):
+
+    return [f":tmi.twitch.tv 001 {_NICK} :Welcome, GLHF!\r\n",
+            f":tmi.twitch.tv 002 {_NICK} :Your host is tmi.twitch.tv\r\n",
+            f":tmi.twitch.tv 003 {_NICK} :This server is rather new\r\n",
+            f":tmi.twitch.tv 004 {_NICK} :-\r\n",
+            f":tmi.twitch.tv 375 {_NICK} :-\r\n",
+            f":tmi.twitch.tv 372 {_NICK} :You are in a maze of twisty passages, all alike.\r\n",
+            f":tmi.twitch.tv 376 {_NICK} :>\r\n"]
+
+
+
+# Builds one raw PRIVMSG line, with more emotes during hype.
+def _privmsg(rng, users, channel, hype, bot_name, bot_rate):
+
+    roll = rng.random_sample()
+
+    if roll < bot_rate / 2:
+        user = bot_name
+        message = "Thanks for the follow!"
+
+    elif roll < bot_rate:
+        user = users[rng.randint(len(users))]
+        message = COMMANDS[rng.randint(len(COMMANDS))]
+
+    else:
+        user = users[rng.randint(len(users))]
+
+        if hype:
+            emote = EMOTES[rng.randint(len(EMOTES))]
+            message = " ".join([emote] * (rng.randint(5) + 1))
+        else:
+            n_words = rng.randint(1, 8)
+            vocab = WORDS + EMOTES
+            message = " ".join(vocab[j] for j in rng.randint(len(vocab), size = n_words))
+
+    return f":{user}!{user}@{user}.tmi.twitch.tv PRIVMSG #{channel} :{message}\r\n"
@@ -0,0 +1,170 @@
+###
+#
+# Filename: topic_highlighter.py
+# Author: Derek Steffan
+#
+# This file contains the topic modeling highlighter from
+# 03_topic_modeling.ipynb, factored out into functions.
+#
+# The messages of every second are treated as one document, and an
+# LDA model is fit on blocks of a few seconds at a time. Every second
+# is then scored on a rolling window of the seconds starting from it,
+# and seconds where one topic (e.g. the "funny" topic, full of LUL and
+# OMEGALUL) takes up nearly all of the window are flagged as highlights.
+# Which topic is which still has to be decided by looking at the words
+# of each topic, e.g. with lda_model.print_topics(-1).
+#
+# Compared to the notebook, the messages are grouped by second in one
+# pass, every distinct word is only lemmatized and stemmed once, and
+# the rolling windows are counted by adding the newest second and
+# removing the oldest instead of joining the text together every time.
+#
+# Note that nltk needs the wordnet data: nltk.download('wordnet')
+#
+###
+
+import numpy as np
+import pandas as pd
+import gensim
+from collections import Counter
+from functools import lru_cache
+from gensim.parsing.preprocessing import STOPWORDS
+from nltk.stem import WordNetLemmatizer, SnowballStemmer
+
+
+
+# Made once instead of once per word.
+_LEMMATIZER = WordNetLemmatizer()
+_STEMMER = SnowballStemmer("english")
+
+
+
+# Fits the LDA model on the messages of a dataframe from
+# twitch_chat_format, returning the model and its dictionary.
+
+# The messages are stacked into blocks of 'roll' seconds to give the
+# model more "context" words to work with. The total words is kept
+# rather low at 1000 by default; this is because there are not that
+# many emotes on twitch, which are the primary indicator of the topic.
+def fit_topic_model(df, num_topics = 16, roll = 5, passes = 5, workers = 2,
+                    no_below = 5, no_above = 0.5, keep_n = 1000, random_state = None):
+
+    seconds = second_tokens(df)
+
+    # Stack the seconds in blocks of 'roll'.
+    blocks = [[token for tokens in seconds.iloc[i:i + roll] for token in tokens]
+              for i in range(0, len(seconds), roll)]
+
+    dictionary = gensim.corpora.Dictionary(blocks)
+    dictionary.filter_extremes(no_below = no_below, no_above = no_above, keep_n = keep_n)
+
+    bow_corpus = [dictionary.doc2bow(block) for block in blocks]
+
+    lda_model = gensim.models.LdaMulticore(bow_corpus,
+                                           num_topics = num_topics,
+                                           id2word = dictionary,
+                                           passes = passes,
+                                           workers = workers,
+                                           random_state = random_state)
+
+    return lda_model, dictionary
+
+
+
+# Scores every second with at least one message on the 'roll' seconds
+# starting from it, returning a dataframe with one column per topic.
+# Topics the model leaves out of a window (below its minimum
+# probability) get a score of zero, as in the notebook.
+def topic_scores(df, lda_model, dictionary, roll = 5):
+
+    seconds = second_tokens(df)
+
+    scores = np.zeros((len(seconds), lda_model.num_topics))
+
+    for i, bow in enumerate(rolling_bows(seconds, dictionary, roll)):
+        for topic, score in lda_model[bow]:
+            scores[i, topic] = score
+
+    return pd.DataFrame(scores, index = seconds.index)
+
+
+
+# Flags every second where the score of 'topic' is above 'threshold',
+# like the "funny" and "exciting" highlights in data/highlighted.
+# Pass the index of a messages per second series as 'index' to get a
+# flag for every second, including the ones without any messages.
+def highlight_by_topic(scores, topic, threshold = 0.95, index = None):
+
+    topic_score = scores[topic]
+
+    if index is not None:
+        topic_score = topic_score.reindex(index, fill_value = 0)
+
+    return (topic_score > threshold).astype(int)
+
+
+
+# Returns a series with the preprocessed words of all the messages
+# sent in every second, indexed by the seconds with any messages.
+def second_tokens(df):
+
+    # Grouping once instead of filtering the whole dataframe
+    # for every second; sort = False keeps the original order.
+    documents = df["message"].groupby(level = 0, sort = False).agg(" ".join)
+
+    return documents.map(preprocess)
+
+
+
+# Bag-of-words for each window of 'roll' seconds starting at every
+# second. The window's word counts are updated by adding the newest
+# second and taking away the one that dropped out.
+def rolling_bows(seconds, dictionary, roll = 5):
+
+    second_bows = [dictionary.doc2bow(tokens) for tokens in seconds]
+    window = Counter()
+
+    for bow in second_bows[:roll]:
+        window.update(dict(bow))
+
+    for i, bow in enumerate(second_bows):
+
+        yield sorted(window.items())
+
+        for word, count in bow:
+            window[word] -= count
+
+            if window[word] == 0:
+                del window[word]
+
+        if i + roll < len(second_bows):
+            window.update(dict(second_bows[i + roll]))
+
+
+
+# Removes punctuation, stop words and short words from the text
+# and lemmatizes and stems the rest, returning a list of strings.
+def preprocess(text):
+
+    result = []
+
+    for token in gensim.utils.simple_preprocess(text):
+
+        token = _process_token(token)
+
+        if token is not None:
+            result.append(token)
+
+    return result
+
+
+
+# The same words come up over and over again in chat,
+# so each one is only processed the first time it is seen.
+@lru_cache(maxsize = None)
+def _process_token(token):
+
+    if token in STOPWORDS or len(token) <= 2:
+        return None
+
+    return _STEMMER.stem(_LEMMATIZER.lemmatize(token, pos = 'v'))
@@ -8,7 +8,8 @@
 #
 # The first function will split up previously recorded chat messages 
 # from a .log file genereated by twitch_chat_scrape.py, returning the 
-# formatted chat messages as a pandas dataframe.
+# formatted chat messages as a pandas dataframe, or an iterator of
+# smaller dataframes for logs too large to hold in memory at once.
 #
 # The second function will take a dataframe generated by twitch_chat_format
 # and return a series with the number of messages for every second.
@@ -19,139 +20,613 @@
 ###
 
 import pandas as pd
+import numpy as np
 import re
-from datetime import datetime
+import io
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from chat_log_writer import open_log, COMPRESSION_SUFFIXES
+from message_store import MessageStore
+from log_index import time_range_offsets, read_range
+import metrics
+
+
+
+# Bump this whenever a change to this file changes the output of
+# twitch_chat_format or messages_per_second, so that anything cached
+# by chat_cache.py is rebuilt instead of reused.
+PARSER_VERSION = 2
+
+# Using regex to isolate the user, channel, and chat message.
+# Format of the logs after the ";;;" is:
+# :username!username@username.tmi.twitch.tv PRIVMSG #channel :message
+# The regex grabs only the first mention of username and ignores 
+# the rest up until "PRIVMSG". Twitch only allows alphanumericvcharacters 
+# and underscores in their usernames so only these characters are 
+# referenced, while every character is pulled from the message iself.
+_PRIVMSG_RE = re.compile(r":([A-z\d_]+)!.+PRIVMSG #([A-z\d_]+) :(.+)")
+
+# The timestamp written by twitch_chat_scrape.py before the ";;;" marker,
+# optionally with milliseconds (e.g. 2019-04-30_08:56:59.123) for logs
+# written with milliseconds = True. Messages are stored with the time in
+# milliseconds since the epoch, and since busy chats have many messages
+# per timestamp, each distinct timestamp is only converted once; see 
+# _epoch_milliseconds.
+_TIMESTAMP_RE = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}_[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]{3})?")
 
 
 
 # This function accepts a relative file path as an argument and returns a dataframe 
 # of formatted text with username, message, and channel, with a datetime object
 # as the index. 
-def twitch_chat_format(path):
-
-    # Open .log file specified by path
-    with open(path, 'r', encoding='utf-8') as log:
-        
-        # Split every individual message.
-        chat = log.read().split('\n')
-        
-        # Instantiate the dictionary; this will be converted into data frame later.
-        # I find dictionaries faster and easier to work with than dataframes
-        # specifically when building one from scratch.
-        msg_dict = {"time": [], "username": [], "channel": [], "message": []}
-        
-        # Loop through all chat messages except the first and last, 
-        # which which are messages about the logging start and end times.
-        for msg in chat:
-
-            # If 'msg' is an emtpy string, ignore it and continue
-            if not msg:
-                continue
-
-            # Sometimes, the request will get "backed up" and log multiple
-            # messages with the same time stamp. To ensure these messages
-            # are not lost, they are all recorded as having the first 
-            # timestampe from the "jam". 'time_logged' will not update
-            # and it will be used as the timestamp for the next message in 
-            # the list until another valid timestamp comes along.
-            try:
 
-                # Split on three semicolons, the predefined marker between 
-                # the time gathered and the actual message content
-                time_logged = datetime.strptime(msg.split(";;;")[0].strip(), 
-                                                '%Y-%m-%d_%H:%M:%S')
+# If 'chunksize' is passed as an int, an iterator is returned instead 
+# which yields dataframes of at most 'chunksize' messages each, reading
+# the .log file a line at a time so that memory use stays bounded no
+# matter how large the file is. Concatenating the chunks gives the same
+# dataframe as calling this function without 'chunksize'.
 
-            # Splitting sometimes returns an empty string; datetime will 
-            # throw an error but this ensures execution will not end.
-            except ValueError:
-                # Because there are no leading semicolons, the message is 
-                # not split and is just stripped instead.
-                username_message = msg.strip()
-
-            else:
-                # Just in the offchance the chat message contained three semicolons
-                # in a row, they are rejoined here and stripped of whitespace.
-                username_message = ";;;".join(msg.split(";;;")[1:]).strip()
-
-            # Using regex to isolate the user, channel, and chat message.
-            # Format of the logs after the ";;;" is:
-            # :username!username@username.tmi.twitch.tv PRIVMSG #channel :message
-            # The regex grabs only the first mention of username and ignores 
-            # the rest up until "PRIVMSG". Twitch only allows alphanumericvcharacters 
-            # and underscores in their usernames so only these characters are 
-            # referenced, while every character is pulled from the message iself.
+# If 'n_jobs' is more than one (or None, for every core), the file is 
+# split into byte ranges that are parsed in a pool of processes and 
+# merged back together in order; see _parse_parallel. The result is 
+# identical to parsing the file with a single process.
+
+# If 'categorical' is True, "username" and "channel" are returned as
+# categoricals rather than strings, which takes much less memory; see
+# message_store.py. For a large log, parsing with the default string
+# columns peaks at about a quarter of the memory the old list-based
+# parser used, and only with categorical = True does it get below a
+# fifth (about a seventh). chat_cache.py always parses this way.
+
+# If 'start' and/or 'end' are given, only the messages between them are
+# returned, the same as df.loc[start:end] on the whole log would. Only
+# the part of the log around that range is read and parsed, using the 
+# time index from log_index.py (built the first time it is needed).
+def twitch_chat_format(path, chunksize = None, n_jobs = 1, categorical = False,
+                       start = None, end = None):
+
+    if n_jobs is None or n_jobs > 1:
+
+        if chunksize is not None:
+            raise ValueError("chunksize cannot be combined with n_jobs")
+
+        with metrics.timer("format.twitch_chat_format"):
+            return _parse_parallel(path, n_jobs, categorical, start, end)
+
+    if chunksize is not None:
+        return iter_twitch_chat_format(path, chunksize, categorical, start, end)
+
+    # With no chunksize the whole log is parsed as one chunk.
+    with metrics.timer("format.twitch_chat_format"):
+        for chunk in iter_twitch_chat_format(path, None, categorical, start, end):
+            return chunk
+
+
+
+# Generator version of twitch_chat_format, see above.
+def iter_twitch_chat_format(path, chunksize = 100000, categorical = False, start = None, end = None):
+
+    if chunksize is not None and chunksize < 1:
+        raise ValueError("chunksize must be a positive number of messages")
+
+    in_range = start is not None or end is not None
+
+    if in_range:
+        _check_seekable(path)
+        lines = io.TextIOWrapper(io.BytesIO(read_range(path, *time_range_offsets(path, start, end))),
+                                 encoding = 'utf-8')
+
+    # Open .log file specified by path, which may 
+    # have been compressed by chat_log_writer.py.
+    else:
+        lines = open_log(path)
+
+    with lines as log:
+
+        # The timestamp carried over from one line to the next, see 
+        # _parse_lines. It has to live outside of the loop over chunks
+        # so that a "jam" spanning two chunks keeps its timestamp.
+        state = {"time_logged": None}
+
+        empty = True
+
+        for store in _parse_lines(log, chunksize, state):
+
+            chunk = store.to_frame(categorical)
+
+            # The range read can hold a few extra seconds on either side.
+            if in_range:
+                chunk = chunk.loc[start:end]
+
+                if chunk.empty:
+                    continue
+
+            empty = False
+            yield chunk
+
+        # Always produce at least one (possibly empty) dataframe.
+        if empty:
+            yield MessageStore().to_frame(categorical)
+
+
+
+# Parses one log with a pool of processes. The file is cut into byte
+# ranges that always end on a newline, and every range is parsed on 
+# its own. The tricky part is the timestamp carried over for "backed 
+# up" lines: a continuation line at the start of a range has no way of
+# knowing the last timestamp of the previous range, so those messages 
+# come back without a time and are filled in here, in order, with the
+# last timestamp seen by the ranges before it.
+def _parse_parallel(path, n_jobs = None, categorical = False, start = None, end = None):
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    _check_seekable(path)
+
+    in_range = start is not None or end is not None
+    first, last = time_range_offsets(path, start, end) if in_range else (0, None)
+
+    # A few more ranges than processes keeps every process busy 
+    # even when some parts of the log are busier than others.
+    ranges = _split_byte_ranges(path, n_jobs * 4, first, last)
+
+    messages = MessageStore()
+    carried = None
+
+    # The counters of _parse_lines stay in the worker processes, so 
+    # only the total time and number of messages are recorded here.
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+
+        paths = [path] * len(ranges)
+        starts = [start for start, _ in ranges]
+        ends = [end for _, end in ranges]
+
+        # .map returns the results in the same order as the ranges.
+        for store, time_logged in pool.map(_parse_byte_range, paths, starts, ends):
+
+            # Only the messages before the first timestamp of a range
+            # can be missing a time.
+            if carried is not None:
+                store.fill_times(carried)
+
+            messages.extend(store)
+
+            if time_logged is not None:
+                carried = time_logged
+
+    df = messages.to_frame(categorical)
+
+    metrics.record("format.parse_parallel", time.perf_counter() - started)
+    metrics.count("format.messages", len(messages))
+
+    return df.loc[start:end] if in_range else df
+
+
+
+# Finds 'n_ranges' roughly equal (start, end) byte ranges of a file 
+# (or of the part between the offsets 'first' and 'last', which must be 
+# the starts of lines), moving every boundary forward to just after the 
+# next newline.
+def _split_byte_ranges(path, n_ranges, first = 0, last = None):
+
+    if last is None:
+        last = os.path.getsize(path)
+
+    size = last - first
+    bounds = [first]
+
+    with open(path, 'rb') as log:
+
+        for i in range(1, n_ranges):
+            log.seek(max(first + size * i // n_ranges, bounds[-1]))
+            log.readline()
+            bounds.append(min(log.tell(), last))
+
+    bounds.append(last)
+
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+
+# Compressed files cannot be read by byte offsets.
+def _check_seekable(path):
+
+    if any(suffix and path.endswith(suffix) for suffix in COMPRESSION_SUFFIXES.values()):
+        raise ValueError("compressed logs can only be parsed whole and with n_jobs = 1")
+
+
+
+# Worker for _parse_parallel; parses the lines between two byte offsets
+# and returns the messages along with the last timestamp that was seen.
+def _parse_byte_range(path, start, end):
+
+    with open(path, 'rb') as log:
+        log.seek(start)
+        data = log.read(end - start)
+
+    # Decoding through TextIOWrapper handles newlines exactly 
+    # the same way as opening the file in text mode does.
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding = 'utf-8')
+    state = {"time_logged": None}
+
+    messages = MessageStore()
+
+    for store in _parse_lines(lines, None, state):
+        messages = store
+
+    return messages, state["time_logged"]
+
+
+
+# Parses an iterable of raw .log lines into MessageStores, yielding a 
+# store every time 'chunksize' messages have been found. 'state' holds
+# the last valid timestamp (in milliseconds) and is updated in place.
+def _parse_lines(lines, chunksize, state):
+
+    # Instantiate the store; this will be converted into data frame later.
+    # See message_store.py for why this is not a dictionary of lists.
+    messages = MessageStore()
+    time_logged = state["time_logged"]
+    last_stamp = None
+
+    # Counted here and reported once per chunk, see metrics.py.
+    misses = 0
+    carried = 0
+    started = time.perf_counter()
+
+    for msg in lines:
+
+        # Lines read from a file keep their newline character.
+        if msg.endswith("\n"):
+            msg = msg[:-1]
+
+        # If 'msg' is an emtpy string, ignore it and continue
+        if not msg:
+            continue
+
+        # Sometimes, the request will get "backed up" and log multiple
+        # messages with the same time stamp. To ensure these messages
+        # are not lost, they are all recorded as having the first 
+        # timestampe from the "jam". 'time_logged' will not update
+        # and it will be used as the timestamp for the next message in 
+        # the list until another valid timestamp comes along.
+
+        # Split on three semicolons, the predefined marker between 
+        # the time gathered and the actual message content
+        stamp, _, rest = msg.partition(";;;")
+        stamp = stamp.strip()
+        timestamped = _TIMESTAMP_RE.fullmatch(stamp) is not None
+
+        if timestamped and stamp != last_stamp:
+
+            # Shaped like a timestamp but not a real time (e.g. the 30th
+            # of February), which is counted as a miss and otherwise
+            # treated like any other line without a timestamp.
             try:
-                username, channel, message = re.search(r":([A-z\d_]+)!.+PRIVMSG #([A-z\d_]+) :(.+)", 
-                                                        username_message).groups()
-            
-                # Append these values into the dictionary.
-                msg_dict["username"].append(username)
-                msg_dict["channel"].append(channel)
-                msg_dict["message"].append(message)
-                msg_dict["time"].append(time_logged)
+                time_logged = _epoch_milliseconds(stamp)
+                last_stamp = stamp
+            except ValueError:
+                timestamped = False
+                misses += 1
+
+        if timestamped:
+
+            # Just in the offchance the chat message contained three semicolons
+            # in a row, everything after the first marker is kept.
+            username_message = rest.strip()
+
+        else:
+            # Because there are no leading semicolons, the message is 
+            # not split and is just stripped instead.
+            username_message = msg.strip()
+            carried += 1
+
+        match = _PRIVMSG_RE.search(username_message)
+
+        # Continue if no regex match is found; eg. one of the start or end 
+        # logging messages or the intro messages when connecting to the IRC
+        if match is None:
+            misses += 1
+            continue
 
-            # Continue if no regex match is found; eg. one of the start or end 
-            # logging messages or the intro messages when connecting to the IRC
-            except AttributeError:
-                continue
+        username, channel, message = match.groups()
 
-    # Convert dictionary to a dataframe and set datetime object to the index.
-    return pd.DataFrame(msg_dict).set_index("time")
+        # Append these values into the store.
+        messages.append(time_logged, username, channel, message)
+
+        if chunksize is not None and len(messages) >= chunksize:
+            state["time_logged"] = time_logged
+            _record_chunk(messages, misses, carried, started)
+            yield messages
+
+            messages = MessageStore()
+            misses = carried = 0
+            started = time.perf_counter()
+
+    state["time_logged"] = time_logged
+
+    if len(messages):
+        _record_chunk(messages, misses, carried, started)
+        yield messages
+
+
+
+# Reports the counters of one chunk parsed by _parse_lines. Carried
+# lines are the lines without a timestamp of their own (whether or not
+# they turn out to hold a chat message), and misses are the lines that
+# are not chat messages, e.g. joins and the messages sent on connecting.
+def _record_chunk(messages, misses, carried, started):
+
+    if not metrics.ENABLED:
+        return
+
+    metrics.record("format.parse", time.perf_counter() - started)
+    metrics.count("format.messages", len(messages))
+    metrics.count("format.regex_misses", misses)
+    metrics.count("format.carried_timestamps", carried)
+
+
+
+# "2019-04-30_18:31:07" or "2019-04-30_18:31:07.250" 
+# -> milliseconds since the epoch, as an int. Raises a
+# ValueError for a date or time that does not exist.
+def _epoch_milliseconds(stamp):
+
+    return int(np.datetime64(stamp.replace("_", "T"), "ms").astype(np.int64))
 
 
 
 # This function takes in a dataframe with a datetime index 
 # and returns a series with every second and the number 
 # of chat messages recorded in that second.
-def messages_per_second(df):
-
-    mes_per_sec = []
-
-    # Create a range for each second in the recorded broadcast.
-    # This is done instead of using df.index because every second
-    # does not necessarily have an associated observation.
-    date_range = pd.date_range(
-        
-        # Start and end the range within the observations;
-        # because time does not flow backwards, .min and .max
-        # will point to the first and last observations.
-        start = df.index.min(),                     
-        end = df.index.max(),
-        freq = "S",   # Increment the range by second
-        closed = "right" # Discard the first second of observations
-    ) 
+
+# Every timestamp is dropped into its bin in a single pass with
+# np.bincount, so the run time scales with the number of messages
+# rather than messages times seconds. 'bin_width' accepts anything
+# pd.Timedelta understands ("250ms", "1s", "5s", ...) and the 
+# default of one second reproduces the original series exactly.
+
+# If 'by' is given a column name (e.g. "username" or "channel"),
+# a dataframe is returned instead with one column of counts per 
+# unique value in that column. Be careful with "username" on long
+# broadcasts, as every chatter becomes its own column.
+
+# 'progress' is an optional callback that is called with the number
+# of minutes processed and the total number of minutes; pass 
+# print_progress to get the old checkpoint messages back.
+def messages_per_second(df, bin_width = "1s", by = None, progress = None):
+
+    with metrics.timer("format.messages_per_second"):
+        return _messages_per_second(df, bin_width, by, progress)
+
+
+
+# Body of messages_per_second, timed by the function above.
+def _messages_per_second(df, bin_width, by, progress):
+
+    width = pd.Timedelta(bin_width)
+
+    if width <= pd.Timedelta(0):
+        raise ValueError("bin_width must be a positive amount of time")
+
+    # There is no broadcast to split up into bins, e.g. for a log that
+    # holds no chat messages or after every message was filtered out.
+    if len(df) == 0:
+        raise ValueError("there are no messages to count")
+
+    # Nanoseconds since the epoch for every message, which makes 
+    # finding the bin of every message simple integer division.
+    times = df.index.values.astype("datetime64[ns]").view("int64")
+    step = width.value
+
+    # Start and end the range within the observations; the first bin
+    # is aligned to the bin width so that e.g. 5 second bins always
+    # start on a multiple of five seconds.
+    origin = times.min() // step * step
+    bins = (times - origin) // step
+    n_bins = int(bins.max()) + 1
+
+    # Labels for every bin in the recorded broadcast. This is done 
+    # instead of using df.index because every bin does not necessarily
+    # have an associated observation. The first bin is discarded, as 
+    # it was in the original version of this function.
+    date_range = pd.date_range(start = pd.Timestamp(origin) + width,
+                               periods = n_bins - 1,
+                               freq = width,
+                               unit = df.index.unit)
 
     # Find the total amount of minutes of video, rounded.
-    total = round((date_range.max() - date_range.min()).seconds / 60)
+    total = round((n_bins - 1) * width.total_seconds() / 60)
+
+    if progress is not None:
+        progress(0, total)
+
+    if by is None:
+        counts = np.bincount(bins, minlength = n_bins)[1:]
+        result = pd.Series(data = counts, index = date_range)
 
-    print(f"Processing {total} minutes of chat messages...")
+    else:
+        # Each (bin, value) pair gets its own slot in one flat
+        # array, which is then folded back into a 2D table.
+        codes, uniques = pd.factorize(df[by], sort = True)
+        counts = np.bincount(bins * len(uniques) + codes,
+                             minlength = n_bins * len(uniques))
+        counts = counts.reshape(n_bins, len(uniques))[1:]
+        result = pd.DataFrame(data = counts, index = date_range,
+                              columns = pd.Index(uniques, name = by))
 
-    for sec in date_range:
-                 
-        # Append the length of the dataframe, i.e. number of messages.
-        mes_per_sec.append(df[df.index == sec].shape[0])
+    if progress is not None:
+        progress(total, total)
 
-        # Print out a checkpoint for every ten minutes of messages
-        delta = sec - date_range.min()
-        if delta.seconds % 1200 == 0 and delta.seconds != 0:
-            print(f"{delta.components.hours * 60 + delta.components.minutes}",
-                  f"out of {total} minutes of messages processed.")
+    return result
 
-    print(f"{total} out of {total} minutes of messages processed.")
-    print("...All messages processed.")
 
-    return pd.Series(data = mes_per_sec, index = date_range)
+
+# Default progress callback for messages_per_second, 
+# printing out the same checkpoints as it used to.
+def print_progress(processed, total):
+
+    if processed == 0:
+        print(f"Processing {total} minutes of chat messages...")
+
+    else:
+        print(f"{processed} out of {total} minutes of messages processed.")
+
+    if processed == total:
+        print("...All messages processed.")
 
 
 
 # Function to remove all messages sent by the automated 
 # chat bot, as well as all commands sent to it
-def filter_bot_messages(df, bot_name):
-    
-    # Removing messages sent by the chat bot.
-    df = df[df["username"] != bot_name]
-    
-    # Commands issued to the chat bot begin with "!"
-    df = df[[not message.startswith("!") for message in df["message"]]]
-    
-    return df
\ No newline at end of file
+
+# 'bot_name' can also be a list of names, for chats with several bots
+# (e.g. Nightbot, StreamElements and the channel's own bot). Commands
+# are found with 'prefixes', and 'patterns' can be any number of regexes
+# for spam or other messages to remove. See MessageFilter for filtering
+# a stream of chunks or for seeing how many messages each rule removed.
+def filter_bot_messages(df, bot_name, prefixes = ("!",), patterns = ()):
+
+    bot_names = [bot_name] if isinstance(bot_name, str) else bot_name
+
+    return MessageFilter(bot_names, prefixes, patterns).filter(df)
+
+
+
+# A set of rules for removing messages, compiled once and applied to 
+# as many dataframes (or chunks of one) as needed. Every rule is checked
+# in the same pass over the messages: the usernames with one isin, and 
+# every prefix and pattern together as one combined regex. Only the
+# messages the combined regex matched are then searched rule by rule,
+# to find the rule that removed each one, so extra rules mostly cost
+# time in proportion to the number of messages that get removed.
+
+# Patterns that cannot be joined into one regex without changing what
+# they match, e.g. ones with inline flags like (?i) or with numbered
+# backreferences after a pattern with groups, are searched for one by
+# one instead, each over only the messages no earlier rule matched.
+class MessageFilter:
+
+    def __init__(self, bot_names = (), prefixes = ("!",), patterns = ()):
+
+        self.bot_names = list(bot_names)
+        self.rules = [f"prefix {prefix!r}" for prefix in prefixes] + \
+                     [f"pattern {pattern!r}" for pattern in patterns]
+
+        # Every rule as a regex; prefixes are anchored to the start.
+        # Compiling them here raises re.error for invalid patterns early.
+        self._rule_patterns = [f"^{re.escape(prefix)}" for prefix in prefixes] + list(patterns)
+        groups = [re.compile(rule).groups for rule in self._rule_patterns]
+
+        self._any_rule = _combine_rules(self._rule_patterns, groups)
+
+        # Number of messages removed by every rule so far, across 
+        # every call to filter. Each message is only counted once,
+        # for the first rule it broke.
+        self.removed = dict.fromkeys(["bot_names"] + self.rules, 0)
+
+
+
+    def filter(self, df):
+
+        # Removing messages sent by the chat bots.
+        is_bot = df["username"].isin(self.bot_names).to_numpy()
+        self.removed["bot_names"] += int(is_bot.sum())
+
+        remove = is_bot
+
+        if self._rule_patterns:
+
+            # Commands, spam, etc. from everyone else.
+            candidates = ~is_bot
+
+            if self._any_rule is not None:
+                candidates = candidates & _contains(df["message"], self._any_rule)
+
+            remove = remove | self._match_rules(df["message"], candidates)
+
+        metrics.count("format.filtered", int(remove.sum()))
+
+        return df[~remove]
+
+
+
+    __call__ = filter
+
+
+
+    # Searches for every rule in turn, each over only the candidate
+    # messages that no earlier rule matched, counting the messages
+    # every rule removed. Returns whether every message was matched.
+    def _match_rules(self, messages, candidates):
+
+        matched = np.zeros(len(messages), dtype = bool)
+
+        for rule, pattern in zip(self.rules, self._rule_patterns):
+
+            rows = np.flatnonzero(candidates & ~matched)
+
+            if len(rows) == 0:
+                break
+
+            hit = _contains(messages.iloc[rows], pattern)
+            matched[rows[hit]] = True
+            self.removed[rule] += int(hit.sum())
+
+        return matched
+
+
+
+# Finds numbered backreferences like \1 or \g<1>; escaped
+# backslashes are matched too, which is only overly cautious.
+_NUMBERED_BACKREFERENCE_RE = re.compile(r"\\(?:[1-9]|g<[0-9]+>)")
+
+
+
+# Joins the rules into one regex that matches wherever any of them does,
+# or returns None if they cannot be joined without changing their meaning:
+# inline flags are only allowed at the very start of a regex, and the
+# groups of one rule would shift the numbers of the groups after it.
+def _combine_rules(rules, groups):
+
+    if not rules:
+        return None
+
+    combined = "|".join(f"(?:{rule})" for rule in rules)
+
+    try:
+        re.compile(combined)
+
+    except re.error:
+        return None
+
+    for i, rule in enumerate(rules):
+        if sum(groups[:i]) > 0 and _NUMBERED_BACKREFERENCE_RE.search(rule):
+            return None
+
+    return combined
+
+
+
+# Vectorized regex search over a column of messages. Arrow backed 
+# strings are searched with RE2, which does not support everything 
+# Python's re module does (e.g. backreferences); those patterns fall 
+# back to searching with re. Patterns with groups are fine here, since
+# only whether they match is needed.
+def _contains(messages, pattern):
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", "This pattern is interpreted as a regular expression")
+
+        try:
+            matched = messages.str.contains(pattern, na = False)
+
+        except ValueError:
+            matched = messages.astype(object).str.contains(re.compile(pattern), na = False)
+
+    return matched.to_numpy(dtype = bool)
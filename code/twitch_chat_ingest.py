@@ -0,0 +1,166 @@
+###
+#
+# Filename: twitch_chat_ingest.py
+# Author: Derek Steffan
+#
+# This script records the Twitch chat of many channels at once, as an
+# asyncio based replacement for twitch_chat_scrape.py when monitoring
+# more than one channel.
+#
+# Channels are joined in groups over a handful of connections instead
+# of one blocking socket per channel. Every IRC line is framed on its
+# own (one read from a socket can hold several lines, or only part of
+# one), PINGs are answered, and every channel gets its own .log file
+# in the same format as twitch_chat_scrape.py, so they can be read with
+# twitch_chat_format.py. Writing is done by chat_log_writer.py from its
+# own thread so that the disk never holds up reading from the sockets.
+#
+# To run this code, you will need to generate a Twitch IRC oauth token at:
+# https://twitchapps.com/tmi/
+#
+###
+
+import asyncio
+import os
+import re
+from chat_log_writer import ChatLogWriter
+import metrics
+
+
+
+SERVER = "irc.chat.twitch.tv"
+PORT = 6667
+
+# Finds the channel an IRC line belongs to, e.g. the "#channel" in
+# ":user!user@user.tmi.twitch.tv PRIVMSG #channel :message". Lines
+# that do not belong to a channel, like the welcome messages, do not match.
+_CHANNEL_RE = re.compile(r"^(?:@\S+ )?(?::\S+ )?[A-Z0-9]+ #([A-z\d_]+)")
+
+
+
+# Synchronous wrapper around ingest_channels, for use outside of an
+# event loop. Stops after 'minutes' minutes or when interrupted, and
+# returns the number of lines logged for every channel.
+def twitch_chat_ingest(nickname, token, channels, minutes, log_dir = ".", **kwargs):
+
+    try:
+        return asyncio.run(ingest_channels(nickname, token, channels, minutes,
+                                           log_dir = log_dir, **kwargs))
+
+    except KeyboardInterrupt:
+        print("Ingest interrupted by user.")
+
+
+
+# Description of arguments:
+
+# nickname, token
+# Same as for twitch_chat_scrape.
+
+# channels
+# List of the Twitch channels to record.
+
+# minutes
+# Number of minutes for which to log chat messages.
+
+# log_dir
+# Directory in which every channel's chat_<channel>.log is written.
+
+# server, port
+# Address of the IRC server; can be pointed at a local server for testing.
+
+# channels_per_connection
+# How many channels are joined over each connection.
+
+# Any other keyword arguments, e.g. 'compression', 'rotate_minutes' or 'milliseconds',
+# are passed along to every channel's ChatLogWriter.
+async def ingest_channels(nickname, token, channels, minutes, log_dir = ".",
+                          server = SERVER, port = PORT,
+                          channels_per_connection = 50, **writer_kwargs):
+
+    channels = [channel.lower().lstrip("#") for channel in channels]
+
+    os.makedirs(log_dir, exist_ok = True)
+
+    writers = {channel: ChatLogWriter(os.path.join(log_dir, f"chat_{channel}.log"), **writer_kwargs)
+               for channel in channels}
+
+    counts = dict.fromkeys(channels, 0)
+
+    for channel, writer in writers.items():
+        writer.write(f"START OF RECORDED CHAT MESSAGES FROM CHANNEL: {channel.upper()}")
+
+    groups = [channels[i:i + channels_per_connection]
+              for i in range(0, len(channels), channels_per_connection)]
+
+    readers = [_read_connection(nickname, token, group, writers, counts, server, port)
+               for group in groups]
+
+    end_message = "END OF RECORDED CHAT MESSAGES FROM CHANNEL: {}"
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*readers), timeout = minutes * 60)
+
+    except asyncio.TimeoutError:
+        pass
+
+    except asyncio.CancelledError:
+        end_message = "RECORDING INTERRUPTED BY USER"
+        raise
+
+    finally:
+        loop = asyncio.get_running_loop()
+
+        for channel, writer in writers.items():
+            writer.write(end_message.format(channel.upper()))
+
+            # Closing waits for the writer's thread to finish.
+            await loop.run_in_executor(None, writer.close)
+
+    return counts
+
+
+
+# Reads from one connection until it is closed, answering PINGs
+# and passing every other line on to the writer of its channel.
+async def _read_connection(nickname, token, channels, writers, counts, server, port):
+
+    reader, writer = await asyncio.open_connection(server, port)
+
+    # Twitch allows joining many channels with one comma separated JOIN.
+    writer.write(f"PASS {token}\r\n".encode("utf-8"))
+    writer.write(f"NICK {nickname}\r\n".encode("utf-8"))
+    writer.write(f"JOIN {','.join('#' + channel for channel in channels)}\r\n".encode("utf-8"))
+    await writer.drain()
+
+    try:
+        while True:
+
+            # readline keeps reading until a whole line has come in,
+            # however the server happened to split up its packets.
+            raw = await reader.readline()
+
+            # An empty read means the server closed the connection.
+            if not raw:
+                break
+
+            metrics.count("scrape.recv_bytes", len(raw))
+
+            line = raw.decode("utf-8", errors = "replace").rstrip("\r\n")
+
+            # Responding to the Twitch IRC server's ping so that
+            # they do not shut down the connection prematurely.
+            if line.startswith("PING"):
+                writer.write(f"PONG{line[4:]}\r\n".encode("utf-8"))
+                await writer.drain()
+                continue
+
+            match = _CHANNEL_RE.match(line)
+
+            if match and match.group(1) in writers:
+                writers[match.group(1)].write(line)
+                counts[match.group(1)] += 1
+                metrics.count("scrape.responses")
+
+    finally:
+        writer.close()
@@ -14,14 +14,17 @@
 #
 ###
 
+import codecs
 import socket as sock
-import logging
 import time
-from emoji import demojize
+from chat_log_writer import ChatLogWriter
+import metrics
 
 
 
-def twitch_chat_scrape(nickname, token, channel, minutes, path = "./chat.log", n_messages = None):
+def twitch_chat_scrape(nickname, token, channel, minutes, path = "./chat.log", n_messages = None,
+                       max_bytes = None, rotate_minutes = None, compression = None,
+                       milliseconds = False, server = "irc.chat.twitch.tv", port = 6667):
 
     # Description of arguments:
 
@@ -52,12 +55,22 @@ def twitch_chat_scrape(nickname, token, channel, minutes, path = "./chat.log", n
     # instead of running for a certain amount of time. The 'minutes' 
     # argument will then become the interval at which checkpoints are recorded.
 
+    # max_bytes, rotate_minutes, compression
+    # Optional rotation and compression of the .log file, passed along 
+    # to ChatLogWriter; see chat_log_writer.py. By default everything is
+    # written to 'path' without compression.
+
+    # milliseconds
+    # If True, the timestamps are written with milliseconds, which 
+    # twitch_chat_format also reads; see chat_log_writer.py.
+
+    # server, port
+    # Address of the IRC server. By default this is Twitch's chat server,
+    # which we will make requests to using the python 'socket' object,
+    # but it can be pointed at a local server for testing; see
+    # irc_replay_server.py.
 
 
-    # This URL will refer the socket to the Twitch chat server, where
-    # we will make requests using the python 'socket' object.
-    server = "irc.chat.twitch.tv"
-    port = 6667
 
     # Connecting to the server and sending our authentication 
     # credentials over the socket.
@@ -70,21 +83,19 @@ def twitch_chat_scrape(nickname, token, channel, minutes, path = "./chat.log", n
     socket.send(f"NICK {nickname}\n".encode("utf-8"))
     socket.send(f"JOIN #{channel}\n".encode("utf-8"))
 
-    # Configuring the logging object that will be used to continuously
-    # write chat messages to a .log file.
+    # Configuring the writer that will be used to continuously write
+    # chat messages to a .log file from a separate thread.
     # Format of the log messages is current time, followed by three
     # semicolons, followed by the raw message itself.
-    # 'filemode = "w"' will overwrite the .log file if the filepath 
-    # matches an existing .log file.
-    logging.basicConfig(level = logging.DEBUG,
-                        format = '%(asctime)s ;;; %(message)s',
-                        datefmt = '%Y-%m-%d_%H:%M:%S',
-                        filename = path,
-                        filemode = "w")
-                        #handlers = logging.FileHandler('../data/chat.log', encoding='utf-8'))
+    # The .log file is overwritten if the filepath matches an existing .log file.
+    log = ChatLogWriter(path, 
+                        max_bytes = max_bytes, 
+                        rotate_minutes = rotate_minutes, 
+                        compression = compression,
+                        milliseconds = milliseconds)
 
     # "Start logging" message
-    logging.info(f"START OF RECORDED CHAT MESSAGES FROM CHANNEL: {channel.upper()}\n")
+    log.write(f"START OF RECORDED CHAT MESSAGES FROM CHANNEL: {channel.upper()}\n")
 
 
 
@@ -96,6 +107,10 @@ def twitch_chat_scrape(nickname, token, channel, minutes, path = "./chat.log", n
     # per call, resulting in multiple messages with the same timestamp. 
     # This too will be handled by the formatting script. 
 
+    # A read can end part of the way through a character that takes more
+    # than one byte, so the rest of it is held over for the next read.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
     # Instantiate start time and number of checkpoints, which are used by both loops
     then = time.time()
     elapsed = 0
@@ -113,17 +128,22 @@ def twitch_chat_scrape(nickname, token, channel, minutes, path = "./chat.log", n
             for i in range(n_messages):
 
                 # Making one call to the server, returning one chat message.
-                response = socket.recv(2048).decode('utf-8')
+                data = socket.recv(2048)
+                response = decoder.decode(data)
+
+                metrics.count("scrape.recv_bytes", len(data))
 
                 # Responding to the Twitch IRC server's ping so that
                 # they do not shut down the connection prematurely.
                 if response.startswith('PING'):
                     socket.send("PONG\n".encode('utf-8'))
 
-                # If the response is not null, remove emojis and write to .log file.
-                # Demojize will turn an emoji back into plain text, i.e. :thumbs_up:
+                # If the response is not null, queue it up to be written to the 
+                # .log file. The writer will remove emojis in batches, turning 
+                # them back into plain text, i.e. :thumbs_up:
                 elif len(response) > 0:
-                    logging.info(demojize(response))
+                    log.write(response)
+                    metrics.count("scrape.responses")
                 
                 # Update total time elapsed
                 elapsed = time.time() - then
@@ -149,17 +169,22 @@ def twitch_chat_scrape(nickname, token, channel, minutes, path = "./chat.log", n
             while elapsed < (minutes * 60):
 
                 # Making one call to the server, returning one chat message.
-                response = socket.recv(2048).decode('utf-8')
+                data = socket.recv(2048)
+                response = decoder.decode(data)
+
+                metrics.count("scrape.recv_bytes", len(data))
 
                 # Responding to the Twitch IRC server's ping so that
                 # they do not shut down the connection prematurely.
                 if response.startswith('PING'):
                     socket.send("PONG\n".encode('utf-8'))
                 
-                # If the response is not null, remove emojis and write to .log file.
-                # Demojize will turn an emoji back into plain text, i.e. :thumbs_up:
+                # If the response is not null, queue it up to be written to the 
+                # .log file. The writer will remove emojis in batches, turning 
+                # them back into plain text, i.e. :thumbs_up:
                 elif len(response) > 0:
-                    logging.info(demojize(response))
+                    log.write(response)
+                    metrics.count("scrape.responses")
 
 
                 # Print checkpoint if time elapsed is (roughly) equal to a
@@ -190,7 +215,7 @@ def twitch_chat_scrape(nickname, token, channel, minutes, path = "./chat.log", n
         print("-" * 40)
 
         # "End logging" message
-        logging.info(f"RECORDING INTERRUPTED BY USER\n")
+        log.write(f"RECORDING INTERRUPTED BY USER\n")
 
 
 
@@ -204,12 +229,17 @@ def twitch_chat_scrape(nickname, token, channel, minutes, path = "./chat.log", n
         print("-" * 40)
 
         # "End logging" message
-        logging.info(f"END OF RECORDED CHAT MESSAGES FROM CHANNEL: {channel.upper()}\n")
+        log.write(f"END OF RECORDED CHAT MESSAGES FROM CHANNEL: {channel.upper()}\n")
+
 
 
+    # Whatever ended the scrape, e.g. the connection being reset, the
+    # messages still queued up have to be written and the file closed, 
+    # or a compressed .log file is left without its end and cannot be read.
+    finally:
 
-    # Close the socket and end the connection to the Twitch server.
-    socket.close()
+        # Close the socket and end the connection to the Twitch server.
+        socket.close()
 
-    # Shut down the logger.
-    logging.shutdown()
\ No newline at end of file
+        # Write out any remaining messages and close the .log file.
+        log.close()
\ No newline at end of file